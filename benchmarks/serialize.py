@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Micro-benchmark of events serialization, in events per second.
+
+Compares the batched serializers of `docker_zabbix_sender.protocol` with the
+former per-event `str.format` loop of `ZabbixSenderEndPoint.emit`.
+
+usage: python benchmarks/serialize.py [events] [rounds]
+"""
+
+import os
+import sys
+import timeit
+
+try:
+    from docker_zabbix_sender import protocol
+except ImportError:
+    # the package requires the docker client, the protocol module does not
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('protocol', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'docker_zabbix_sender', 'protocol.py'
+    ))
+    protocol = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(protocol)
+
+def make_events(count, containers=100):
+    """Events looking like those of `count / containers` metrics for every container"""
+    return [
+        {
+            'hostname': 'container-{0}.docker.docker-daemon.acme.com'.format(i % containers),
+            'key': 'docker.container.metric_{0}'.format(i // containers),
+            'timestamp': 1424363786,
+            'value': float(i) * 1.5 if i % 10 else '',
+        }
+        for i in range(count)
+    ]
+
+def format_loop(events):
+    """Former implementation: one formatted string per event"""
+    out = []
+    fmt = "{hostname} {key} {timestamp} {value}\n"
+    for event in events:
+        event = dict(event)
+        if event['value'] == "":
+            event['value'] = '""'
+        out.append(fmt.format(**event).encode('utf-8'))
+    return out
+
+def main(args):
+    count = int(args[0]) if args else 10000
+    rounds = int(args[1]) if len(args) > 1 else 20
+    events = make_events(count)
+    cache = protocol.FragmentCache()
+    candidates = [
+        ('str.format loop', lambda: format_loop(events)),
+        ('serialize_lines', lambda: protocol.serialize_lines(events, cache)),
+        ('serialize_sender_data', lambda: protocol.serialize_sender_data(events, cache)),
+    ]
+    print("{0} events, best of {1} rounds".format(count, rounds))
+    for name, func in candidates:
+        func() # warm up fragments cache
+        best = min(timeit.repeat(func, number=1, repeat=rounds))
+        print("{0:<24} {1:>12,.0f} events/s".format(name, count / best))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
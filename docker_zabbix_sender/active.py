@@ -0,0 +1,268 @@
+# encoding: utf-8
+
+"""Zabbix active checks support: fetch from Zabbix the list of items
+configured for every host so that only those items are pushed, at their
+configured update interval.
+
+Zabbix only reports *Zabbix agent (active)* items in reply to an active checks
+request, whereas pushed values are only accepted by *Zabbix trapper* items.
+Pushed items are therefore selected with companion active items named
+`docker.sender.push[<trapper item key>]`, whose update interval is used.
+"""
+
+import json
+import logging
+import threading
+
+from .protocol import request
+
+__all__ = [
+    'ActiveChecks',
+    'parse_delay',
+    'selected_key',
+]
+
+SELECTOR_KEY = 'docker.sender.push'
+
+_DELAY_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+
+def parse_delay(delay):
+    """Convert a Zabbix item update interval to a number of seconds.
+
+    Zabbix 3.4+ sends strings with an optional time suffix, possibly followed
+    by flexible intervals ("30s;50s/1-5,09:00-18:00") that are ignored here.
+
+    :param delay: integer or string update interval
+
+    :return: number of seconds, 0 if unknown
+    """
+    if isinstance(delay, int):
+        return delay
+    delay = str(delay).split(';', 1)[0].strip()
+    if not delay:
+        return 0
+    unit = _DELAY_UNITS.get(delay[-1])
+    try:
+        if unit is None:
+            return int(delay)
+        return int(delay[:-1]) * unit
+    except ValueError:
+        return 0
+
+def selected_key(key):
+    """Extract the trapper item key selected by an active item key.
+
+    :param key: key of an active item, like 'docker.sender.push[docker.container.memory.used]'
+    or 'docker.sender.push["key[with,params]"]'
+
+    :return: the selected key, None if the item is not a selector
+    """
+    prefix = SELECTOR_KEY + '['
+    if not key.startswith(prefix) or not key.endswith(']'):
+        return None
+    selected = key[len(prefix):-1].strip()
+    if len(selected) >= 2 and selected[0] == '"' and selected[-1] == '"':
+        selected = selected[1:-1].replace('\\"', '"')
+    return selected or None
+
+class ActiveChecks(threading.Thread):
+    """Repeatedly fetch from a Zabbix server the items selected for a set of hosts.
+
+    All events of a host are considered as wanted as long as its selected items
+    are unknown: not fetched yet, Zabbix could not be reached or answered with
+    an error, or the host has no `docker.sender.push[...]` item.
+    """
+
+    def __init__(self, server, port=10051, refresh=120, timeout=5.0, locate=None):
+        """
+        :param server: hostname or IP address of the Zabbix server, or proxy
+
+        :param port: port of the server trapper
+
+        :param refresh: Number of seconds between 2 updates of the items list.
+        Same as 'RefreshActiveChecks' in Zabbix agent configuration.
+
+        :param timeout: socket timeout, in seconds
+
+        :param locate: optional callable taking a hostname in parameter and returning
+        a tuple (server, port) of the Zabbix server or proxy to ask the items of this host,
+        instead of `server` and `port`.
+        """
+        threading.Thread.__init__(self, name="active-checks")
+        self.daemon = True
+        self._server = server
+        self._port = port
+        self._refresh = refresh
+        self._timeout = timeout
+        self._locate = locate
+        self._logger = logging.getLogger("active-checks")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        # hostname -> {key: delay in seconds}
+        self._items = {}
+        self._tracked = set()
+        # (hostname, key) -> time of the last event pushed
+        self._last_pushed = {}
+
+    def track(self, hostnames):
+        """Declare hosts for which items must be fetched.
+        New hosts are fetched immediately, hosts not given anymore are forgotten.
+
+        :param hostnames: set of hostnames
+        """
+        with self._lock:
+            if hostnames == self._tracked:
+                return
+            new_hosts = hostnames - self._tracked
+            forgotten_hosts = self._tracked - hostnames
+            for hostname in forgotten_hosts:
+                self._items.pop(hostname, None)
+            if forgotten_hosts:
+                self._last_pushed = dict(
+                    (item, last_pushed) for item, last_pushed in self._last_pushed.items()
+                    if item[0] not in forgotten_hosts
+                )
+            self._tracked = set(hostnames)
+        if new_hosts:
+            self._wakeup.set()
+
+    def wanted(self, hostname, key, now):
+        """Tell whether an event must be pushed. If so, the event is considered pushed.
+
+        :param hostname: event hostname
+        :param key: event key
+        :param now: current UNIX time
+
+        :return: True if the item is selected in Zabbix and due, or if the host
+        selected items are unknown. False otherwise.
+        """
+        items = self._items.get(hostname)
+        if not items:
+            return True
+        delay = items.get(key)
+        if delay is None:
+            return False
+        last_pushed = self._last_pushed.get((hostname, key))
+        if last_pushed is not None and now - last_pushed < delay:
+            return False
+        self._last_pushed[(hostname, key)] = now
+        return True
+
+    def wants_any(self, keys):
+        """Tell whether at least one of the given keys is configured for any host.
+
+        :param keys: collection of item keys
+
+        :return: False if no host requires any of the keys
+        """
+        for hostname in self._tracked:
+            items = self._items.get(hostname)
+            if not items:
+                return True
+            for key in keys:
+                if key in items:
+                    return True
+        return False
+
+    def selected_keys(self):
+        """Keys selected by at least one tracked host, meant to avoid computing
+        metrics nobody wants.
+
+        :return: set of keys, None if every key may be wanted because the
+        selected items of a tracked host are unknown, or no host is tracked yet
+        """
+        with self._lock:
+            if not self._tracked:
+                return None
+            keys = set()
+            for hostname in self._tracked:
+                items = self._items.get(hostname)
+                if not items:
+                    return None
+                keys.update(items)
+            return keys
+
+    def state(self):
+        """Snapshot of the internal state, for troubleshooting purpose"""
+        return {
+            'tracked_hosts': len(self._tracked),
+            'fetched_hosts': len(self._items),
+            'items': sum(len(items) for items in list(self._items.values())),
+        }
+
+    def run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            with self._lock:
+                hostnames = [h for h in self._tracked if h not in self._items] or list(self._tracked)
+            # servers that could not be reached during this round are not asked again until the next one
+            unreachable = set()
+            for hostname in hostnames:
+                if self._stopping:
+                    return
+                address = self._address(hostname)
+                if address in unreachable:
+                    continue
+                try:
+                    items = self._fetch(hostname, address)
+                except Exception:
+                    self._logger.exception("Could not fetch active checks of host %s from %s:%s, "
+                        "retrying in %d seconds", hostname, address[0], address[1], self._refresh)
+                    unreachable.add(address)
+                    continue
+                if items is not None:
+                    with self._lock:
+                        if hostname in self._tracked:
+                            self._items[hostname] = items
+            self._wakeup.wait(self._refresh)
+
+    def shutdown(self):
+        """Ask thread termination. Method returns immediatly."""
+        self._stopping = True
+        self._wakeup.set()
+
+    def fetch(self, hostname):
+        """Ask Zabbix the list of items selected for a host.
+
+        :param hostname: host name as declared in Zabbix
+
+        :return: dict of selected key -> delay in seconds,
+        None if Zabbix could not be reached or answered with an error
+        """
+        address = self._address(hostname)
+        try:
+            return self._fetch(hostname, address)
+        except Exception:
+            self._logger.exception("Could not fetch active checks of host %s from %s:%s",
+                hostname, address[0], address[1])
+            return None
+
+    def _address(self, hostname):
+        """Zabbix server or proxy to ask the items of a host
+
+        :return: tuple (server, port)
+        """
+        if self._locate is not None:
+            return tuple(self._locate(hostname))
+        return self._server, self._port
+
+    def _fetch(self, hostname, address):
+        """Same as `fetch`, but raises an exception if Zabbix could not be reached"""
+        payload = json.dumps({'request': 'active checks', 'host': hostname}).encode('utf-8')
+        response = request(address[0], address[1], payload, self._timeout)
+        if response.get('response') != 'success':
+            self._logger.info("No active checks for host %s: %s", hostname, response.get('info'))
+            return None
+        items = {}
+        for item in response.get('data', []):
+            key = selected_key(item['key'])
+            if key is not None:
+                items[key] = parse_delay(item.get('delay', 0))
+        return items
@@ -0,0 +1,68 @@
+# encoding: utf-8
+
+"""Helpers reading cgroup v2 information not provided by the Docker stats stream"""
+
+import os
+
+__all__ = [
+    'PRESSURE_RESOURCES',
+    'container_cgroup_dir',
+    'read_pressure',
+]
+
+PRESSURE_RESOURCES = ('cpu', 'memory', 'io')
+
+# Known locations of a container cgroup, relative to the cgroup v2 mount point,
+# depending on the cgroup driver used by the Docker daemon.
+_CGROUP_LAYOUTS = (
+    'system.slice/docker-{0}.scope', # systemd driver
+    'docker/{0}',                    # cgroupfs driver
+)
+
+def container_cgroup_dir(root, container):
+    """Locate the cgroup v2 directory of a container.
+
+    :param root: cgroup v2 mount point, for instance '/sys/fs/cgroup'
+
+    :param container: full identifier of the Docker container
+
+    :return: absolute path to the container cgroup directory, None if not found
+    """
+    for layout in _CGROUP_LAYOUTS:
+        path = os.path.join(root, layout.format(container))
+        if os.path.isdir(path):
+            return path
+    return None
+
+def read_pressure(path, into):
+    """Parse a PSI file like 'cpu.pressure' and store its values in the given dict.
+
+    File content looks like:
+
+        some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+        full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+
+    Only 'avg10' and 'total' fields are kept, stored under the keys
+    '{some,full}_avg10' and '{some,full}_total'. The existing dict is updated
+    in place so that the collector can reuse it between two samples.
+
+    :param path: absolute path to the PSI file
+
+    :param into: dict to fill
+
+    :return: True if the file could be read, False otherwise
+    """
+    try:
+        with open(path, 'rb') as istr:
+            content = istr.read()
+    except (IOError, OSError):
+        return False
+    for line in content.splitlines():
+        fields = line.split()
+        if len(fields) < 5:
+            continue
+        kind = fields[0].decode('ascii')
+        # fields: kind avg10=X avg60=X avg300=X total=X
+        into[kind + '_avg10'] = float(fields[1][6:])
+        into[kind + '_total'] = int(fields[4][6:])
+    return True
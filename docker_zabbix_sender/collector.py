@@ -8,6 +8,10 @@ import threading
 from docker import DockerClient
 
 from .RWLock import RWLock
+from .rollup import Rollup
+from .samples import SampleStore
+from .cgroup import PRESSURE_RESOURCES, container_cgroup_dir, read_pressure
+from .endpoint import EndPoint
 
 __all__ = [
     'ContainerStatsEmitter',
@@ -20,26 +24,43 @@ class ContainerStats(threading.Thread):
     Those metrics are updated repeatedly (about every second) by
     `stats` method available in Docker remote API since v17.
 
+    Raw CPU, memory and network counters are recorded in a `SampleStore`,
+    where derived metrics of all containers are computed at once.
+    The `user_cpu_percent`, `kernel_cpu_percent`, `memory`, `memory_limit`,
+    `memory_percent`, `network_rx` and `network_tx` read-only properties
+    compute those of this container only.
+
     TODO: make it a thread
     """
 
-    def __init__(self, container, docker):
+    def __init__(self, container, docker, cgroup_root=None, store=None):
         """
         :param container: The Docker container identifier to monitor.
 
         :param docker: Docker client
         :type docker: DockerClient
+
+        :param cgroup_root: cgroup v2 mount point used to read pressure stall
+        information of the container. PSI metrics are not collected if None.
+
+        :param store: `SampleStore` shared by the collectors. A private one is created if None.
         """
-        threading.Thread.__init__(self)
+        # named after the container so that profiles and logs tell collectors apart
+        threading.Thread.__init__(self, name="stats-" + container[:12])
         self.container = container
-        self.name = docker.inspect_container(container)['Config']['Hostname']
-        self.user_cpu_percent = 0.0
-        self.kernel_cpu_percent = 0.0
-        self.memory = 0.0
-        self.memory_limit = 0.0
-        self.memory_percent = 0.0
-        self.network_rx = 0.0
-        self.network_tx = 0.0
+        self.hostname = docker.inspect_container(container)['Config']['Hostname']
+        if store is None:
+            store = SampleStore(capacity=1)
+        self.store = store
+        self.store.allocate(container)
+        self.memory_anon = 0
+        self.memory_file = 0
+        self.memory_kernel = 0
+        self.memory_working_set = 0
+        self.memory_usage_no_cache = 0
+        self.cpu_nr_throttled = 0
+        self.cpu_throttled_usec = 0
+        self.pressure = dict((resource, {}) for resource in PRESSURE_RESOURCES)
         self.io_bytes_read = 0
         self.io_bytes_write = 0
         self.io_bytes_sync = 0
@@ -55,18 +76,14 @@ class ContainerStats(threading.Thread):
         self._docker = docker
         self._lock = RWLock()
         self._response = None
+        self._cgroup_root = cgroup_root
+        self._cgroup_dir = None
 
     def run(self):
         """Collect container metrics repeatedly. Does not returns
         unless the Docker stats stream is closed or the `shutdown` method
         is called.
         """
-        previous_user_cpu = 0.0
-        previous_kernel_cpu = 0.0
-        previous_system = 0.0
-        previous_network_rx = 0.0
-        previous_network_tx = 0.0
-        start = True
         url = self._docker._url("/containers/{0}/stats".format(self.container))
         try:
             self._response = self._docker._get(url, stream=True)
@@ -79,50 +96,33 @@ class ContainerStats(threading.Thread):
                 # Provides additional fields that can be used by metrics plugins
                 stats['name'] = self.name
                 stats['id'] = self.container
-                # code below is strongly inspired from docker's code.
-                mem_percent = float(stats['memory_stats']['usage']) / stats['memory_stats']['limit'] * 100.0
-                user_cpu_percent = 0.0
-                kernel_cpu_percent = 0.0
-                if not start:
-                    user_cpu_percent, kernel_cpu_percent = self._calculate_cpu_percent(
-                        previous_user_cpu,
-                        previous_kernel_cpu,
-                        previous_system,
-                        stats
-                    )
-
-                start = False
+                cpu_stats = stats['cpu_stats']
+                memory_stats = stats['memory_stats']
+                network_rx, network_tx = self._extract_network(stats)
+                self.store.record(
+                    self.container,
+                    float(cpu_stats['cpu_usage']['usage_in_usermode']),
+                    float(cpu_stats['cpu_usage']['usage_in_kernelmode']),
+                    float(cpu_stats['system_cpu_usage']),
+                    self._online_cpus(cpu_stats),
+                    float(memory_stats['usage']),
+                    float(memory_stats['limit']),
+                    network_rx,
+                    network_tx
+                )
+
+                blkio_stats = stats.get('blkio_stats') or {}
+                io_bytes = self._extract_block_io(blkio_stats.get('io_service_bytes_recursive'))
+                io_operations = self._extract_block_io(blkio_stats.get('io_serviced_recursive'))
 
                 self._lock.acquire_write()
-                self.timestamp = stats['timestamp']
-                self.stats = stats
-                self.user_cpu_percent = user_cpu_percent
-                self.kernel_cpu_percent = kernel_cpu_percent
-                self.memory = float(stats['memory_stats']['usage'])
-                self.memory_limit = float(stats['memory_stats']['limit'])
-                self.memory_percent = mem_percent
-
-                current_rx = previous_network_rx
-                current_tx = previous_network_tx
-
-                if 'network' in stats:
-                    # API v1.20 and earlier: only one network
-                    current_rx = float(stats['network']['rx_bytes'])
-                    current_tx = float(stats['network']['tx_bytes'])
-                elif 'networks' in stats:
-                    # API v1.21 and after: multiple networks
-                    current_rx = 0.0
-                    current_tx = 0.0
-                    for net in stats['networks'].values():
-                        self.network_rx += float(net['rx_bytes'])
-                        self.network_tx += float(net['tx_bytes'])
-
-                self.network_rx = current_rx - previous_network_rx
-                self.network_tx = current_tx - previous_network_tx
-
-                io_bytes = self._extract_block_io(stats['blkio_stats']['io_service_bytes_recursive'])
-                io_operations = self._extract_block_io(stats['blkio_stats']['io_serviced_recursive'])
-                self._lock.release()
+                try:
+                    self._extract_throttling(stats['cpu_stats'])
+                    self._extract_memory_breakdown(stats['memory_stats'])
+                    self.timestamp = stats['timestamp']
+                    self.stats = stats
+                finally:
+                    self._lock.release()
 
                 # Store IO values
                 if io_bytes:
@@ -138,13 +138,6 @@ class ContainerStats(threading.Thread):
                     self.io_operations_sync = io_operations['Sync']
                     self.io_operations_async = io_operations['Async']
                     self.io_operations_total = io_operations['Total']
-
-                # Update previous values
-                previous_user_cpu = stats['cpu_stats']['cpu_usage']['usage_in_usermode']
-                previous_kernel_cpu = stats['cpu_stats']['cpu_usage']['usage_in_kernelmode']
-                previous_system = stats['cpu_stats']['system_cpu_usage']
-                previous_network_rx = current_rx
-                previous_network_tx = current_tx
         except (AttributeError, ReadTimeoutError):
             # raise in urllib3 when the stream is closed while waiting for stuff to read
             pass
@@ -166,6 +159,57 @@ class ContainerStats(threading.Thread):
             self._lock.release()
 
 
+    @property
+    def name(self):
+        """Hostname of the container.
+
+        Overrides `Thread.name`: the thread itself is named 'stats-' followed by
+        the container short identifier.
+        """
+        return self.hostname
+
+    @property
+    def user_cpu_percent(self):
+        """Percentage of CPU time spent in user mode since the previous sample"""
+        return self._derived('user_cpu_percent')
+
+    @property
+    def kernel_cpu_percent(self):
+        """Percentage of CPU time spent in kernel mode since the previous sample"""
+        return self._derived('kernel_cpu_percent')
+
+    @property
+    def memory(self):
+        """Memory used by the container, in bytes"""
+        return self._derived('memory')
+
+    @property
+    def memory_limit(self):
+        """Memory limit of the container, in bytes"""
+        return self._derived('memory_limit')
+
+    @property
+    def memory_percent(self):
+        """Percentage of the memory limit used by the container"""
+        return self._derived('memory_percent')
+
+    @property
+    def network_rx(self):
+        """Bytes received since the previous sample"""
+        return self._derived('network_rx')
+
+    @property
+    def network_tx(self):
+        """Bytes sent since the previous sample"""
+        return self._derived('network_tx')
+
+    def _derived(self, name):
+        """Derived metric of this container, computed from the raw counters in the store"""
+        metrics = self.store.sample(self.container)
+        if metrics is None:
+            return 0.0
+        return metrics[name]
+
     def shutdown(self):
         """Stop collecting the container metrics.
         """
@@ -173,41 +217,109 @@ class ContainerStats(threading.Thread):
             self._response.raw.close()
             self._response = None
 
-    def _calculate_cpu_percent(self,
-        previous_user_cpu,
-        previous_kernel_cpu,
-        previous_system,
-        stats
-    ):
-        """Compute CPU percentage.
-
-        strongly inspired from docker's code.
+    @staticmethod
+    def _online_cpus(cpu_stats):
+        """Number of CPU available to the container.
 
-        :return: cpu percentage
+        'percpu_usage' is not provided on cgroup v2 hosts, 'online_cpus' is used instead.
         """
-        user_cpu_percent = 0.0
-        kernel_cpu_percent = 0.0
-        # calculate the change for the cpu usage of the container in between readings
-        user_cpu_delta = float(stats['cpu_stats']['cpu_usage']['usage_in_usermode']) - previous_user_cpu
-        kernel_cpu_delta = float(stats['cpu_stats']['cpu_usage']['usage_in_kernelmode']) - previous_kernel_cpu
-        # calculate the change for the entire system between readings
-        system_delta = float(stats['cpu_stats']['system_cpu_usage']) - previous_system
-        if system_delta > 0.0:
-            if user_cpu_delta > 0.0:
-                user_cpu_percent = (user_cpu_delta / system_delta) * float(len(stats['cpu_stats']['cpu_usage']['percpu_usage'])) * 100.0
-            if kernel_cpu_delta > 0.0:
-                kernel_cpu_percent = (kernel_cpu_delta / system_delta) * float(len(stats['cpu_stats']['cpu_usage']['percpu_usage'])) * 100.0
-        return user_cpu_percent, kernel_cpu_percent
+        online_cpus = cpu_stats.get('online_cpus')
+        if online_cpus:
+            return float(online_cpus)
+        return float(len(cpu_stats['cpu_usage'].get('percpu_usage') or ()))
 
+    @staticmethod
+    def _extract_network(stats):
+        """Sum received and transmitted bytes over all networks of the container
+
+        :return: tuple (rx_bytes, tx_bytes)
+        """
+        if 'network' in stats:
+            # API v1.20 and earlier: only one network
+            return float(stats['network']['rx_bytes']), float(stats['network']['tx_bytes'])
+        rx = 0.0
+        tx = 0.0
+        # API v1.21 and after: multiple networks
+        for net in (stats.get('networks') or {}).values():
+            rx += float(net['rx_bytes'])
+            tx += float(net['tx_bytes'])
+        return rx, tx
+
+
+    def _extract_throttling(self, cpu_stats):
+        """Extract CPU throttling counters of the container
+        """
+        throttling = cpu_stats.get('throttling_data')
+        if throttling:
+            self.cpu_nr_throttled = throttling.get('throttled_periods', 0)
+            # Docker reports throttled time in nanoseconds
+            self.cpu_throttled_usec = throttling.get('throttled_time', 0) // 1000
+
+    def _extract_memory_breakdown(self, memory_stats):
+        """Extract anonymous, file and kernel memory, as well as the working set
+        and the memory used without page cache.
+
+        Handles both cgroup v2 (anon, file, kernel) and cgroup v1 (rss, cache)
+        'memory.stat' keys.
+        """
+        stat = memory_stats.get('stats')
+        if not stat:
+            return
+        usage = memory_stats['usage']
+        if 'anon' in stat:
+            # cgroup v2
+            self.memory_anon = stat['anon']
+            self.memory_file = stat.get('file', 0)
+            if 'kernel' in stat:
+                self.memory_kernel = stat['kernel']
+            else:
+                self.memory_kernel = stat.get('kernel_stack', 0) + stat.get('slab', 0)
+            inactive_file = stat.get('inactive_file', 0)
+        else:
+            # cgroup v1
+            self.memory_anon = stat.get('total_rss', stat.get('rss', 0))
+            self.memory_file = stat.get('total_cache', stat.get('cache', 0))
+            self.memory_kernel = 0
+            inactive_file = stat.get('total_inactive_file', 0)
+        self.memory_working_set = max(usage - inactive_file, 0)
+        self.memory_usage_no_cache = max(usage - self.memory_file, 0)
+
+    def read_pressure(self):
+        """Read pressure stall information of the container cgroup, if available.
+
+        Meant to be called once per push, rather than for every sample of the stats stream.
+        The cgroup directory is looked up again as long as it could not be found.
+        """
+        if self._cgroup_root is None:
+            return
+        if self._cgroup_dir is None:
+            self._cgroup_dir = container_cgroup_dir(self._cgroup_root, self.container)
+            if self._cgroup_dir is None:
+                return
+        for resource in PRESSURE_RESOURCES:
+            path = '{0}/{1}.pressure'.format(self._cgroup_dir, resource)
+            read_pressure(path, self.pressure[resource])
 
     @staticmethod
     def _extract_block_io(stats):
-        """Extract the Read, Write, Sync, Async and Total values from value/op array
+        """Extract the Read, Write, Sync, Async and Total values from value/op array,
+        summed over all devices.
+
+        cgroup v2 hosts report lowercase 'read' and 'write' operations only,
+        or no array at all.
         """
         result = {}
+        if not stats:
+            return result
 
+        for op in ('Read', 'Write', 'Sync', 'Async', 'Total'):
+            result[op] = 0
         for s in stats:
-            result[str(s['op'])] = int(s['value'])
+            op = str(s['op']).capitalize()
+            if op in result:
+                result[op] += int(s['value'])
+        if not result['Total']:
+            result['Total'] = result['Read'] + result['Write']
 
         return result
 
@@ -217,7 +329,39 @@ class ContainerStatsEmitter(threading.Thread):
     is updated according to containers started, stopped, ...
     """
 
-    def __init__(self, client, endpoint_func, delay=30):
+    # metrics key -> `SampleBatch` column
+    BATCH_METRICS = (
+        ('cpu.user_percent', 'user_cpu_percent'),
+        ('cpu.kernel_percent', 'kernel_cpu_percent'),
+        ('memory.used', 'memory'),
+        ('memory.limit', 'memory_limit'),
+        ('memory.percent', 'memory_percent'),
+        ('network_rx', 'network_rx'),
+        ('network_tx', 'network_tx'),
+    )
+    # metrics key -> `ContainerStats` attribute
+    STATS_METRICS = (
+        ('memory.anon', 'memory_anon'),
+        ('memory.file', 'memory_file'),
+        ('memory.kernel', 'memory_kernel'),
+        ('memory.working_set', 'memory_working_set'),
+        ('memory.usage_no_cache', 'memory_usage_no_cache'),
+        ('cpu.nr_throttled', 'cpu_nr_throttled'),
+        ('cpu.throttled_usec', 'cpu_throttled_usec'),
+        ('io_bytes_read', 'io_bytes_read'),
+        ('io_bytes_write', 'io_bytes_write'),
+        ('io_bytes_sync', 'io_bytes_sync'),
+        ('io_bytes_async', 'io_bytes_async'),
+        ('io_bytes_total', 'io_bytes_total'),
+        ('io_operations_read', 'io_operations_read'),
+        ('io_operations_write', 'io_operations_write'),
+        ('io_operations_sync', 'io_operations_sync'),
+        ('io_operations_async', 'io_operations_async'),
+        ('io_operations_total', 'io_operations_total'),
+    )
+
+    def __init__(self, client, endpoint_func, delay=30, cgroup_root=None, rollup_labels=None,
+                 scheduler=None, active_checks=None):
         """
         :param client: Docker client
 
@@ -225,64 +369,146 @@ class ContainerStatsEmitter(threading.Thread):
         The endpoint_func may also have a 'close' callable attribute.
 
         :param delay: Number of seconds between 2 notifications of `endpoint_func`
+
+        :param cgroup_root: cgroup v2 mount point given to the `ContainerStats` collectors
+
+        :param rollup_labels: optional list of container label keys. Metrics are also
+        aggregated per value of those labels, and given to `endpoint_func` as well.
+
+        :param scheduler: optional `schedule.AdaptiveInterval` instance. If specified,
+        it decides the number of seconds between 2 notifications instead of `delay`.
+        The chosen interval is given to `endpoint_func` as well.
+
+        :param active_checks: optional `active.ActiveChecks` instance used by `endpoint_func`.
+        If specified, metrics that no host selects are not computed.
         """
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, name="stats-emitter")
         self._client = client
         self._endpoint_func = endpoint_func
         self._delay = delay
-        self._stop = False
+        self._cgroup_root = cgroup_root
+        self._rollup = Rollup(rollup_labels) if rollup_labels else None
+        self._scheduler = scheduler
+        self._active_checks = active_checks
+        self._store = SampleStore()
+        self._container_stats = dict()
+        # duration in seconds of every stage of the last push
+        self.last_cycle = dict()
+        self._stopping = False
         self._logger = logging.getLogger("stats-emitter")
 
     def run(self):
-        container_stats = dict()
+        container_stats = self._container_stats
+        container_labels = dict()
         try:
             while self._should_run():
                 # update list of container stats
-                running_containers = set(map(lambda c: c['Id'], self._client.containers()))
+                cycle_start = time.time()
+                containers = self._client.containers()
+                container_labels = dict((c['Id'], c.get('Labels')) for c in containers)
+                running_containers = set(container_labels.keys())
                 monitored_containers = set(container_stats.keys())
                 started_containers = running_containers - monitored_containers
                 stopped_containers = monitored_containers - running_containers
                 for container in stopped_containers:
                     self._logger.info("container has stopped: %s", container)
                     container_stats.pop(container).shutdown()
+                    self._store.release(container)
                 for container in started_containers:
                     self._logger.info("Monitoring activity of container: %s", container)
-                    stats = ContainerStats(container, self._client)
+                    stats = ContainerStats(container, self._client, self._cgroup_root, self._store)
                     container_stats[container] = stats
                     stats.start()
-                time.sleep(self._delay)
+                churn = bool(started_containers or stopped_containers)
+                update_duration = time.time() - cycle_start
+                if self._scheduler is not None:
+                    if churn:
+                        self._scheduler.churn()
+                    time.sleep(self._scheduler.interval)
+                else:
+                    time.sleep(self._delay)
                 if not self._should_run():
                     return
                 # collect results
+                collect_start = time.time()
                 payload = []
+                rollup = self._rollup
+                if rollup is not None:
+                    rollup.reset()
+                # derived metrics of all containers are computed in one pass
+                batch = self._store.compute()
+                wanted = self._wanted_metrics()
+                batch_metrics = [
+                    (key, getattr(batch, column)) for key, column in ContainerStatsEmitter.BATCH_METRICS
+                    if wanted is None or key in wanted
+                ]
+                stats_metrics = [
+                    (key, attribute) for key, attribute in ContainerStatsEmitter.STATS_METRICS
+                    if wanted is None or key in wanted
+                ]
+                pressure = self._cgroup_root is not None and (
+                    wanted is None or any(key.startswith('pressure.') for key in wanted)
+                )
+                # groups are still counted when no metric is aggregated, to keep their hosts tracked
+                aggregate = wanted is None or any(
+                    key.endswith('.sum') or key.endswith('.max') for key in wanted
+                )
                 def append(stats):
-                    payload.append({
+                    index = batch.index(stats.container)
+                    if index is None:
+                        # no sample received yet
+                        return
+                    metrics = {
                         'name': stats.name,
                         'id': stats.container,
                         'stats': stats.stats,
-                        'cpu.user_percent': stats.user_cpu_percent,
-                        'cpu.kernel_percent': stats.kernel_cpu_percent,
-                        'memory.used': stats.memory,
-                        'memory.limit': stats.memory_limit,
-                        'memory.percent': stats.memory_percent,
-                        'network_rx': stats.network_rx,
-                        'network_tx': stats.network_tx,
-                        'io_bytes_read': stats.io_bytes_read,
-                        'io_bytes_write': stats.io_bytes_write,
-                        'io_bytes_sync': stats.io_bytes_sync,
-                        'io_bytes_async': stats.io_bytes_async,
-                        'io_bytes_total': stats.io_bytes_total,
-                        'io_operations_read': stats.io_operations_read,
-                        'io_operations_write': stats.io_operations_write,
-                        'io_operations_sync': stats.io_operations_sync,
-                        'io_operations_async': stats.io_operations_async,
-                        'io_operations_total': stats.io_operations_total,
                         'timestamp': stats.timestamp,
-                    })
+                    }
+                    for key, column in batch_metrics:
+                        metrics[key] = column[index]
+                    for key, attribute in stats_metrics:
+                        metrics[key] = getattr(stats, attribute)
+                    if pressure:
+                        for resource, values in stats.pressure.items():
+                            for field, value in values.items():
+                                metrics['pressure.' + resource + '.' + field] = value
+                    payload.append(metrics)
+                    if rollup is not None:
+                        rollup.add(container_labels.get(stats.container), metrics if aggregate else {})
                 for stats in container_stats.values():
+                    if pressure:
+                        # PSI files are read once per push, outside of the collector lock
+                        stats.read_pressure()
                     stats.emit(append)
+                if rollup is not None:
+                    payload.extend(rollup.payload(int(time.time())))
+                if self._scheduler is not None:
+                    pending = getattr(self._endpoint_func, 'pending', None)
+                    self._scheduler.update(
+                        payload,
+                        churn,
+                        self.last_cycle.get('emit', 0.0),
+                        pending() if pending is not None else 0
+                    )
+                    payload.append({
+                        'hostname': '-',
+                        'name': None,
+                        'stats': None,
+                        'timestamp': int(time.time()),
+                        'sender.interval': self._scheduler.interval,
+                    })
                 # emit to endpoint_func
+                push_start = time.time()
                 self._endpoint_func(self._client, payload)
+                push_end = time.time()
+                self.last_cycle = {
+                    'update': update_duration,
+                    'collect': push_start - collect_start,
+                    'emit': push_end - push_start,
+                    'containers': len(container_stats),
+                    'metrics': len(payload),
+                    'timestamp': push_end,
+                }
         finally:
             self._logger.info("waiting for all collectors threads to terminate.")
             for container in container_stats.values():
@@ -297,8 +523,62 @@ class ContainerStatsEmitter(threading.Thread):
         """Ask thread termination. Method returns immediatly. You may
         call the `Thread.join` method afterward."""
         self._logger.info("user asked for daemon termination.")
-        self._stop = True
+        self._stopping = True
+
+    def state(self):
+        """Snapshot of the emitter internal state, for troubleshooting purpose.
+
+        :return: dict
+        """
+        now = time.time()
+        containers = []
+        for container, stats in list(self._container_stats.items()):
+            containers.append({
+                'id': container,
+                'name': stats.name,
+                'alive': stats.is_alive(),
+                'last_sample_age': now - stats.timestamp if stats.stats is not None else None,
+                'lock': {
+                    'rwlock': stats._lock.rwlock,
+                    'writers_waiting': stats._lock.writers_waiting,
+                },
+            })
+        state = {
+            'interval': self._scheduler.interval if self._scheduler is not None else self._delay,
+            'last_cycle': self.last_cycle,
+            'containers': containers,
+        }
+        if hasattr(self._endpoint_func, 'state'):
+            state['endpoint'] = self._endpoint_func.state()
+        return state
+
+    def _wanted_metrics(self):
+        """Metrics keys to compute, without the `EndPoint.EVENT_KEY_PREFIX` prefix.
+
+        Keys aggregated over groups of containers are given with their '.sum'
+        or '.max' suffix, as well as without it. Metrics watched by the scheduler
+        are always computed.
+
+        :return: set of keys, None if every metric must be computed
+        """
+        if self._active_checks is None:
+            return None
+        selected = self._active_checks.selected_keys()
+        if selected is None:
+            return None
+        prefix = EndPoint.EVENT_KEY_PREFIX
+        wanted = set()
+        for key in selected:
+            if not key.startswith(prefix):
+                continue
+            key = key[len(prefix):]
+            wanted.add(key)
+            if key.endswith('.sum') or key.endswith('.max'):
+                wanted.add(key[:-4])
+        if self._scheduler is not None:
+            wanted.update(self._scheduler.WATCHED_METRIC_KEYS)
+        return wanted
 
     def _should_run(self):
         """Internal method used to know if the show must go on"""
-        return not self._stop
+        return not self._stopping
@@ -0,0 +1,120 @@
+# encoding: utf-8
+
+"""Troubleshooting helpers of a running daemon, triggered by signals:
+
+- a sampling profiler of all threads, writing collapsed stacks
+  that can be given to flamegraph tools
+- a dump of the daemon internal state
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+__all__ = [
+    'SamplingProfiler',
+    'dump_state',
+]
+
+LOGGER = logging.getLogger("debug")
+
+def thread_name(thread):
+    """Name of a thread, even if its class overrides the `name` attribute,
+    like `collector.ContainerStats` does."""
+    return threading.Thread.name.fget(thread)
+
+class SamplingProfiler(object):
+    """Samples stacks of all threads during a limited period of time.
+
+    Nothing runs between 2 profiles. Only one profile runs at a time.
+    """
+
+    def __init__(self, duration=30, interval=0.01, output_dir=None):
+        """
+        :param duration: number of seconds a profile lasts
+
+        :param interval: number of seconds between 2 samples
+
+        :param output_dir: directory where profiles are written, system temporary directory if None
+        """
+        self.duration = duration
+        self.interval = interval
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start a profile in background, unless one is already running.
+
+        :return: True if a new profile started
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                LOGGER.info("a profile is already running")
+                return False
+            self._thread = threading.Thread(target=self._profile, name="profiler")
+            self._thread.daemon = True
+            self._thread.start()
+            return True
+
+    def _profile(self):
+        LOGGER.info("profiling all threads for %d seconds", self.duration)
+        me = threading.current_thread().ident
+        stacks = {}
+        samples = 0
+        deadline = time.time() + self.duration
+        while time.time() < deadline:
+            names = dict((thread.ident, thread_name(thread)) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{0} ({1}:{2})'.format(
+                        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+                    ))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                collapsed = ';'.join(stack)
+                stacks[collapsed] = stacks.get(collapsed, 0) + 1
+            del frame
+            samples += 1
+            time.sleep(self.interval)
+        path = os.path.join(
+            self.output_dir,
+            'docker-zabbix-sender-{0}-{1}.collapsed'.format(os.getpid(), int(time.time()))
+        )
+        with open(path, 'w') as ostr:
+            for stack, count in sorted(stacks.items()):
+                ostr.write('{0} {1}\n'.format(stack, count))
+        LOGGER.info("profile of %d samples written in %s", samples, path)
+        return path
+
+def dump_state(emitter, output_dir=None):
+    """Write the internal state of the daemon in a JSON file.
+
+    :param emitter: the running `ContainerStatsEmitter`
+
+    :param output_dir: directory where the file is written, system temporary directory if None
+
+    :return: path to the written file
+    """
+    state = {
+        'timestamp': time.time(),
+        'threads': sorted(thread_name(thread) for thread in threading.enumerate()),
+        'emitter': emitter.state(),
+    }
+    path = os.path.join(
+        output_dir or tempfile.gettempdir(),
+        'docker-zabbix-sender-{0}-{1}.state.json'.format(os.getpid(), int(time.time()))
+    )
+    with open(path, 'w') as ostr:
+        json.dump(state, ostr, indent=2, sort_keys=True, default=str)
+    LOGGER.info("daemon state written in %s", path)
+    return path
@@ -4,10 +4,14 @@ import inspect
 import logging
 import pkg_resources
 import socket
+import time
+
+from .sinks import SinkWorker
 
 __all__ = [
     'EndPoint',
-    'PPrintEndPoint'
+    'PPrintEndPoint',
+    'FanOutEndPoint'
 ]
 
 class EndPoint(object):
@@ -18,18 +22,27 @@ class EndPoint(object):
 
     You need to implement the `emit` member method.
     """
-    def __init__(self, host):
+    def __init__(self, host, active_checks=None):
         """
         :param host: FQDN of the host running the monitored containers
+
+        :param active_checks: optional `active.ActiveChecks` instance. If specified,
+        only events of items configured in Zabbix are emitted, at their update interval.
         """
         self._logger = logging.getLogger("end-point")
         self._host = host
+        self._active_checks = active_checks
         self.metrics_plugins = self._load_metrics_plugins()
 
-    IGNORED_METRIC_KEYS = {'name', 'timestamp', 'stats'}
+    IGNORED_METRIC_KEYS = {'name', 'timestamp', 'stats', 'label', 'hostname'}
     METRICS_GROUP = 'docker_zabbix_sender.metrics'
     EVENT_KEY_PREFIX = 'docker.container.'
 
+    @property
+    def host(self):
+        """FQDN of the host running the monitored containers"""
+        return self._host
+
     @classmethod
     def container_hostname(cls, host, container_name):
         """Get "real" hostname of a container.
@@ -40,6 +53,14 @@ class EndPoint(object):
         """
         return "{0}.docker.{1}".format(container_name, host)
 
+    @classmethod
+    def group_hostname(cls, host, label_key, label_value):
+        """Get hostname of a group of containers sharing the same label value.
+
+        Default implement returns: '{label_value}.{label_key}.docker.{current_host_fqdn}'
+        """
+        return "{0}.{1}.docker.{2}".format(label_value, label_key, host)
+
     def __call__(self, client, containers_metrics):
         """Method used by collector to emit new metrics to this end-point.
         Metrics are translated, enriched, and passed to the `emit` member method
@@ -47,6 +68,8 @@ class EndPoint(object):
         :param client: Docker client
 
         :params containers_metrics: list of dict with containers information, one dict per container.
+        Dicts holding a 'label' key provide metrics aggregated over a group of containers.
+        Dicts holding a 'hostname' key provide metrics of that host, '-' being the daemon host.
         """
         events, statistics = self._metrics_to_events(containers_metrics)
         self._enrich_with_plugins(client, statistics, events)
@@ -63,6 +86,21 @@ class EndPoint(object):
         """
         pass
 
+    def state(self):
+        """Snapshot of the endpoint internal state, for troubleshooting purpose.
+        Meant to be extended.
+
+        :return: dict
+        """
+        state = {
+            'type': type(self).__name__,
+            'host': self._host,
+            'plugins': sorted(self.metrics_plugins.keys()),
+        }
+        if self._active_checks is not None:
+            state['active_checks'] = self._active_checks.state()
+        return state
+
     def _metrics_to_events(self, containers_metrics):
         """Transform list of dict containing containers metrics to a list of dict with the following keys:
             'host', 'key', 'value'
@@ -73,13 +111,27 @@ class EndPoint(object):
         """
         events = []
         stats = []
+        active_checks = self._active_checks
+        if active_checks is not None:
+            hostnames = set(
+                self._zabbix_hostname(self._metrics_hostname(metrics))
+                for metrics in containers_metrics
+            )
+            hostnames.add(self._host)
+            active_checks.track(hostnames)
+            now = int(time.time())
         for metrics in containers_metrics:
-            stats.append(metrics['stats'])
-            hostname = EndPoint.container_hostname(self._host, metrics['name'])
+            if metrics['stats'] is not None:
+                stats.append(metrics['stats'])
+            hostname = self._metrics_hostname(metrics)
+            zabbix_hostname = self._zabbix_hostname(hostname)
             timestamp = metrics['timestamp']
             for key, value in metrics.items():
                 if key in EndPoint.IGNORED_METRIC_KEYS:
                     continue
+                if active_checks is not None and \
+                        not active_checks.wanted(zabbix_hostname, EndPoint.EVENT_KEY_PREFIX + key, now):
+                    continue
                 events.append({
                     'hostname': hostname,
                     'timestamp': timestamp,
@@ -88,6 +140,14 @@ class EndPoint(object):
                 })
         return events, stats
 
+    def _metrics_hostname(self, metrics):
+        """Hostname of the events built from metrics given to the endpoint"""
+        if 'hostname' in metrics:
+            return metrics['hostname']
+        if 'label' in metrics:
+            return EndPoint.group_hostname(self._host, metrics['label'], metrics['name'])
+        return EndPoint.container_hostname(self._host, metrics['name'])
+
     def _enrich_with_plugins(self, client, statistics, events):
         """Ask registered metrics plugins to produce additional events according to new containers metrics
 
@@ -96,13 +156,35 @@ class EndPoint(object):
         :param statistics: list of tuple providing container statistics, one dict per container.
 
         :param events: events collection, to be filled by metrics plugins
+
+        When active checks are enabled, plugins declaring the list of keys they
+        produce in a `keys` attribute are not called if no host requires them.
         """
+        active_checks = self._active_checks
         for name, collector in self.metrics_plugins.items():
+            if active_checks is not None:
+                keys = getattr(collector, 'keys', None)
+                if keys and not active_checks.wants_any(keys):
+                    continue
             try:
-                events.extend(collector(self._host, client, statistics))
+                plugin_events = collector(self._host, client, statistics)
+                if active_checks is None:
+                    events.extend(plugin_events)
+                else:
+                    now = int(time.time())
+                    events.extend(
+                        event for event in plugin_events
+                        if active_checks.wanted(self._zabbix_hostname(event['hostname']), event['key'], now)
+                    )
             except Exception as e:
                 self._logger.exception("Could not collect metrics from plugin %s", name)
 
+    def _zabbix_hostname(self, hostname):
+        """Hostname of an event as known by Zabbix: '-' stands for the daemon host"""
+        if hostname == '-':
+            return self._host
+        return hostname
+
     def _load_metrics_plugins(self):
         """Loads objects registered with the '[docker-zabbix-sender.metrics]' entry point.
         :return dict of plugin_name -> callable_object
@@ -124,3 +206,64 @@ class PPrintEndPoint(EndPoint):
     def emit(self, events):
         import pprint
         pprint.pprint(events)
+
+
+class FanOutEndPoint(EndPoint):
+    """EndPoint forwarding the same events to several sinks.
+
+    Events are translated and enriched once, then handed to every sink.
+    Each sink is fed by its own thread through a bounded queue, so that a slow
+    or failing sink neither stalls the others nor the collector.
+    """
+    def __init__(self, host, sinks, queue_size=4, active_checks=None, close_timeout=10.0):
+        """
+        :param host: FQDN of the host running the monitored containers
+
+        :param sinks: list of objects with an `emit` member method, like `EndPoint`
+        instances or those provided by the `sinks` module.
+
+        :param queue_size: maximum number of batches pending for each sink
+
+        :param active_checks: optional `active.ActiveChecks` instance
+
+        :param close_timeout: maximum number of seconds to wait for sinks to flush
+        pending events when the endpoint is closed
+        """
+        EndPoint.__init__(self, host, active_checks=active_checks)
+        self._close_timeout = close_timeout
+        self._workers = [SinkWorker(sink, queue_size) for sink in sinks]
+        for worker in self._workers:
+            worker.start()
+
+    def emit(self, events):
+        if not events:
+            return
+        for worker in self._workers:
+            worker.submit(events)
+
+    def pending(self):
+        """Highest number of batches waiting to be emitted by a sink"""
+        return max(worker.pending() for worker in self._workers) if self._workers else 0
+
+    def close(self):
+        # all sinks flush in parallel, so that a stuck sink does not prevent others from being closed
+        deadline = time.time() + self._close_timeout
+        for worker in self._workers:
+            worker.stop()
+        for worker in self._workers:
+            worker.join(max(deadline - time.time(), 0))
+        for worker in self._workers:
+            worker.close_sink()
+
+    def state(self):
+        state = EndPoint.state(self)
+        state['sinks'] = [
+            {
+                'name': worker.name,
+                'alive': worker.is_alive(),
+                'pending': worker.pending(),
+                'dropped': worker.dropped,
+            }
+            for worker in self._workers
+        ]
+        return state
@@ -0,0 +1,185 @@
+# encoding: utf-8
+
+"""Serialization of events to the formats understood by Zabbix:
+
+- the line format read by the `zabbix_sender` utility from its input file
+- the JSON format of the Zabbix trapper protocol ("sender data" request)
+
+Both serializers write the whole batch into a single buffer. Hostname and
+key fragments are encoded once and reused across events and batches.
+
+It also provides the ZBXD framing used to talk to a Zabbix server or proxy.
+"""
+
+import json
+import socket
+import struct
+
+__all__ = [
+    'FragmentCache',
+    'serialize_lines',
+    'serialize_sender_data',
+    'pack',
+    'unpack_header',
+    'request',
+]
+
+ZBXD_HEADER = b'ZBXD\x01'
+ZBXD_HEADER_LENGTH = 13
+
+class FragmentCache(object):
+    """Holds encoded hostname and key fragments between 2 serializations.
+
+    The cache is reset when it grows beyond `max_size` entries, so that
+    hostnames of containers that are long gone do not stay in memory forever.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.line_hostnames = {}
+        self.line_keys = {}
+        self.json_hostnames = {}
+        self.json_keys = {}
+
+    def reset_if_full(self):
+        for fragments in (self.line_hostnames, self.line_keys, self.json_hostnames, self.json_keys):
+            if len(fragments) > self.max_size:
+                fragments.clear()
+
+def _value_to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, str):
+        value = str(value)
+    return value.encode('utf-8')
+
+def serialize_lines(events, cache):
+    """Serialize events to the `zabbix_sender` input file format:
+
+        {hostname} {key} {timestamp} {value}
+
+    Timestamps are written if the first event provides one.
+
+    :param events: list of dict with the following keys: hostname, timestamp, key, value
+
+    :param cache: `FragmentCache` instance
+
+    :return: bytearray holding the whole batch
+    """
+    cache.reset_if_full()
+    buf = bytearray()
+    if not events:
+        return buf
+    hostnames = cache.line_hostnames
+    keys = cache.line_keys
+    with_timestamps = 'timestamp' in events[0]
+    for event in events:
+        hostname = event['hostname']
+        prefix = hostnames.get(hostname)
+        if prefix is None:
+            prefix = hostnames[hostname] = (hostname + ' ').encode('utf-8')
+        key = event['key']
+        key_fragment = keys.get(key)
+        if key_fragment is None:
+            key_fragment = keys[key] = (key + ' ').encode('utf-8')
+        buf += prefix
+        buf += key_fragment
+        if with_timestamps:
+            buf += b'%d ' % event['timestamp']
+        value = event['value']
+        if value == "":
+            # Prevent empty string from crashing zabbix-sender
+            buf += b'""'
+        else:
+            buf += _value_to_bytes(value)
+        buf += b'\n'
+    return buf
+
+def serialize_sender_data(events, cache):
+    """Serialize events to the JSON payload of a trapper "sender data" request.
+
+    :param events: list of dict with the following keys: hostname, timestamp, key, value
+
+    :param cache: `FragmentCache` instance
+
+    :return: bytearray holding the JSON document, without the ZBXD header
+    """
+    cache.reset_if_full()
+    hostnames = cache.json_hostnames
+    keys = cache.json_keys
+    buf = bytearray(b'{"request":"sender data","data":[')
+    first = True
+    for event in events:
+        if first:
+            first = False
+        else:
+            buf += b','
+        hostname = event['hostname']
+        prefix = hostnames.get(hostname)
+        if prefix is None:
+            prefix = hostnames[hostname] = ('{"host":' + json.dumps(hostname) + ',').encode('utf-8')
+        key = event['key']
+        key_fragment = keys.get(key)
+        if key_fragment is None:
+            key_fragment = keys[key] = ('"key":' + json.dumps(key) + ',"value":').encode('utf-8')
+        buf += prefix
+        buf += key_fragment
+        value = event['value']
+        if not isinstance(value, str):
+            value = str(value)
+        buf += json.dumps(value).encode('utf-8')
+        timestamp = event.get('timestamp')
+        if timestamp is not None:
+            buf += b',"clock":%d' % timestamp
+        buf += b'}'
+    buf += b']}'
+    return buf
+
+def pack(payload):
+    """Prepend the ZBXD header to a payload.
+
+    :param payload: bytes-like JSON document
+
+    :return: bytearray ready to be sent to a Zabbix server or proxy
+    """
+    buf = bytearray(ZBXD_HEADER)
+    buf += struct.pack('<Q', len(payload))
+    buf += payload
+    return buf
+
+def unpack_header(header):
+    """Decode a ZBXD header.
+
+    :param header: the first `ZBXD_HEADER_LENGTH` bytes of a response
+
+    :return: length of the payload following the header
+    """
+    if header[:5] != ZBXD_HEADER:
+        raise ValueError("Invalid Zabbix response header: %r" % header[:5])
+    return struct.unpack('<Q', header[5:ZBXD_HEADER_LENGTH])[0]
+
+def _recv_exactly(sock, length):
+    buf = bytearray()
+    while len(buf) < length:
+        chunk = sock.recv(min(length - len(buf), 65536))
+        if not chunk:
+            raise IOError("Connection closed by Zabbix after %d bytes out of %d" % (len(buf), length))
+        buf += chunk
+    return buf
+
+def request(server, port, payload, timeout=5.0):
+    """Send a request to a Zabbix server or proxy and return the decoded response.
+
+    :param server: hostname or IP address of the Zabbix server
+    :param port: port of the server trapper
+    :param payload: bytes-like JSON document, without the ZBXD header
+    :param timeout: socket timeout, in seconds
+
+    :return: the JSON response as a dict
+    """
+    sock = socket.create_connection((server, int(port)), timeout)
+    try:
+        sock.sendall(pack(payload))
+        length = unpack_header(bytes(_recv_exactly(sock, ZBXD_HEADER_LENGTH)))
+        return json.loads(_recv_exactly(sock, length).decode('utf-8'))
+    finally:
+        sock.close()
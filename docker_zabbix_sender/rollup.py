@@ -0,0 +1,79 @@
+# encoding: utf-8
+
+"""Aggregation of containers metrics per label value, for instance
+per compose project, swarm service or Kubernetes pod."""
+
+__all__ = [
+    'Rollup',
+]
+
+class Rollup(object):
+    """Incrementally computes sum and max of every numeric metric, as well as
+    the number of containers, grouped by the value of configured label keys.
+
+    A container contributes to one group per label key it holds.
+    """
+
+    IGNORED_METRIC_KEYS = {'timestamp'}
+
+    def __init__(self, label_keys):
+        """
+        :param label_keys: collection of container label keys to group by,
+        for instance 'com.docker.compose.project'
+        """
+        self.label_keys = list(label_keys)
+        self._groups = {}
+
+    def reset(self):
+        """Forget all groups, to start a new aggregation"""
+        self._groups = {}
+
+    def add(self, labels, metrics):
+        """Account metrics of a container.
+
+        :param labels: dict of the container labels
+
+        :param metrics: dict of the container metrics, as given to the endpoint
+        """
+        if not labels:
+            return
+        for label_key in self.label_keys:
+            value = labels.get(label_key)
+            if value is None:
+                continue
+            group = self._groups.get((label_key, value))
+            if group is None:
+                group = self._groups[(label_key, value)] = {'count': 0}
+            group['count'] += 1
+            for key, metric in metrics.items():
+                if key in Rollup.IGNORED_METRIC_KEYS or \
+                        isinstance(metric, bool) or not isinstance(metric, (int, float)):
+                    continue
+                sum_key = key + '.sum'
+                if sum_key in group:
+                    group[sum_key] += metric
+                    max_key = key + '.max'
+                    if metric > group[max_key]:
+                        group[max_key] = metric
+                else:
+                    group[sum_key] = metric
+                    group[key + '.max'] = metric
+
+    def payload(self, timestamp):
+        """Provides aggregated metrics, one dict per group, in the same form as
+        containers metrics. Instead of a container name, 'name' holds the label value,
+        and the additional 'label' key holds the label key.
+
+        :param timestamp: UNIX time of the aggregation
+
+        :return: list of dict
+        """
+        payload = []
+        for (label_key, value), group in self._groups.items():
+            metrics = dict(group)
+            metrics['name'] = value
+            metrics['label'] = label_key
+            metrics['stats'] = None
+            metrics['timestamp'] = timestamp
+            payload.append(metrics)
+        return payload
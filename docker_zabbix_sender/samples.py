@@ -0,0 +1,253 @@
+# encoding: utf-8
+
+"""Columnar storage of containers raw counters.
+
+Collectors record raw counters of their container in a shared `SampleStore`,
+and derived metrics (CPU and memory percentages, network deltas) are computed
+for all containers at once when metrics are pushed. NumPy is used if available,
+otherwise the computation falls back to pure Python over `array.array` columns.
+"""
+
+from array import array
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = [
+    'SampleStore',
+    'SampleBatch',
+]
+
+class SampleBatch(object):
+    """Derived metrics of all containers of a `SampleStore`, one list per metric.
+
+    Use the `index` member method to get the position of a container in those lists.
+    """
+    COLUMNS = (
+        'user_cpu_percent',
+        'kernel_cpu_percent',
+        'memory',
+        'memory_limit',
+        'memory_percent',
+        'network_rx',
+        'network_tx',
+    )
+
+    def __init__(self, slots, columns):
+        self._slots = slots
+        for name in SampleBatch.COLUMNS:
+            setattr(self, name, columns[name])
+
+    def index(self, container):
+        """
+        :param container: container identifier
+
+        :return: position of the container in the metrics lists, None if the container has no sample
+        """
+        return self._slots.get(container)
+
+class SampleStore(object):
+    """Holds the current and previous raw counters of every container in contiguous columns.
+
+    Each container owns a slot, i.e an index in every column, between
+    the `allocate` and `release` calls.
+    """
+    # counters for which the previous sample is kept to compute deltas
+    COUNTERS = ('user_cpu', 'kernel_cpu', 'system_cpu', 'network_rx', 'network_tx')
+    # instant values
+    GAUGES = ('online_cpus', 'memory', 'memory_limit')
+    _COUNTER_COLUMNS = tuple(('current_' + name, 'previous_' + name) for name in COUNTERS)
+
+    def __init__(self, capacity=64, use_numpy=True):
+        """
+        :param capacity: initial number of slots
+
+        :param use_numpy: use NumPy arrays if NumPy is installed
+        """
+        self._numpy = numpy if use_numpy else None
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._free = []
+        self._size = 0
+        self._capacity = 0
+        self._columns = {}
+        names = ['samples']
+        for name in SampleStore.COUNTERS:
+            names.extend(['current_' + name, 'previous_' + name])
+        names.extend(SampleStore.GAUGES)
+        for name in names:
+            self._columns[name] = self._new_column(0)
+        self._grow(max(capacity, 1))
+
+    def allocate(self, container):
+        """Reserve a slot for a container.
+
+        :param container: container identifier
+        """
+        with self._lock:
+            if container in self._slots:
+                return
+            if self._free:
+                slot = self._free.pop()
+            else:
+                if self._size == self._capacity:
+                    self._grow(self._capacity * 2)
+                slot = self._size
+                self._size += 1
+            self._columns['samples'][slot] = 0
+            self._slots[container] = slot
+
+    def release(self, container):
+        """Free the slot of a container, samples recorded afterward are ignored.
+
+        :param container: container identifier
+        """
+        with self._lock:
+            slot = self._slots.pop(container, None)
+            if slot is not None:
+                self._columns['samples'][slot] = 0
+                self._free.append(slot)
+
+    def record(self, container, user_cpu, kernel_cpu, system_cpu, online_cpus,
+               memory, memory_limit, network_rx, network_tx):
+        """Store a new sample of a container, the current one becoming the previous one.
+
+        :param container: container identifier
+        """
+        with self._lock:
+            slot = self._slots.get(container)
+            if slot is None:
+                return
+            columns = self._columns
+            counters = (user_cpu, kernel_cpu, system_cpu, network_rx, network_tx)
+            for (current_name, previous_name), value in zip(SampleStore._COUNTER_COLUMNS, counters):
+                current = columns[current_name]
+                columns[previous_name][slot] = current[slot]
+                current[slot] = value
+            columns['online_cpus'][slot] = online_cpus
+            columns['memory'][slot] = memory
+            columns['memory_limit'][slot] = memory_limit
+            columns['samples'][slot] += 1
+
+    def compute(self):
+        """Compute derived metrics of all containers having at least one sample.
+
+        CPU percentages and network deltas are computed between the last 2
+        samples of a container, and are 0 until 2 samples are available.
+
+        :return: `SampleBatch` instance
+        """
+        with self._lock:
+            size = self._size
+            slots = dict(
+                (container, slot) for container, slot in self._slots.items()
+                if self._columns['samples'][slot] > 0
+            )
+            if self._numpy is not None:
+                columns = dict((name, column[:size].copy()) for name, column in self._columns.items())
+            else:
+                columns = dict((name, column[:size]) for name, column in self._columns.items())
+        if self._numpy is not None:
+            return SampleBatch(slots, self._compute_numpy(columns))
+        return SampleBatch(slots, self._compute_python(columns, size))
+
+    def sample(self, container):
+        """Compute derived metrics of a single container.
+
+        :param container: container identifier
+
+        :return: dict metric name -> value, None if the container has no sample
+        """
+        with self._lock:
+            slot = self._slots.get(container)
+            if slot is None or self._columns['samples'][slot] == 0:
+                return None
+            columns = dict(
+                (name, array('d', column[slot:slot + 1])) for name, column in self._columns.items()
+            )
+        return dict((name, values[0]) for name, values in self._compute_python(columns, 1).items())
+
+    def _compute_numpy(self, columns):
+        np = self._numpy
+        has_previous = columns['samples'] > 1
+        system_delta = columns['current_system_cpu'] - columns['previous_system_cpu']
+        valid_system = has_previous & (system_delta > 0.0)
+        cpu_factor = np.where(
+            valid_system,
+            columns['online_cpus'] * 100.0 / np.where(valid_system, system_delta, 1.0),
+            0.0
+        )
+        result = {}
+        for name in ('user_cpu', 'kernel_cpu'):
+            delta = columns['current_' + name] - columns['previous_' + name]
+            result[name + '_percent'] = np.where(delta > 0.0, delta * cpu_factor, 0.0).tolist()
+        for name in ('network_rx', 'network_tx'):
+            delta = columns['current_' + name] - columns['previous_' + name]
+            result[name] = np.where(has_previous, delta, 0.0).tolist()
+        memory = columns['memory']
+        memory_limit = columns['memory_limit']
+        result['memory'] = memory.tolist()
+        result['memory_limit'] = memory_limit.tolist()
+        result['memory_percent'] = np.where(
+            memory_limit > 0.0,
+            memory * 100.0 / np.where(memory_limit > 0.0, memory_limit, 1.0),
+            0.0
+        ).tolist()
+        return result
+
+    def _compute_python(self, columns, size):
+        samples = columns['samples']
+        current_user, previous_user = columns['current_user_cpu'], columns['previous_user_cpu']
+        current_kernel, previous_kernel = columns['current_kernel_cpu'], columns['previous_kernel_cpu']
+        current_system, previous_system = columns['current_system_cpu'], columns['previous_system_cpu']
+        current_rx, previous_rx = columns['current_network_rx'], columns['previous_network_rx']
+        current_tx, previous_tx = columns['current_network_tx'], columns['previous_network_tx']
+        online_cpus = columns['online_cpus']
+        memory = columns['memory']
+        memory_limit = columns['memory_limit']
+        user_cpu_percent = [0.0] * size
+        kernel_cpu_percent = [0.0] * size
+        memory_percent = [0.0] * size
+        network_rx = [0.0] * size
+        network_tx = [0.0] * size
+        for slot in range(size):
+            if memory_limit[slot] > 0.0:
+                memory_percent[slot] = memory[slot] * 100.0 / memory_limit[slot]
+            if samples[slot] < 2:
+                continue
+            network_rx[slot] = current_rx[slot] - previous_rx[slot]
+            network_tx[slot] = current_tx[slot] - previous_tx[slot]
+            system_delta = current_system[slot] - previous_system[slot]
+            if system_delta > 0.0:
+                cpu_factor = online_cpus[slot] * 100.0 / system_delta
+                user_delta = current_user[slot] - previous_user[slot]
+                if user_delta > 0.0:
+                    user_cpu_percent[slot] = user_delta * cpu_factor
+                kernel_delta = current_kernel[slot] - previous_kernel[slot]
+                if kernel_delta > 0.0:
+                    kernel_cpu_percent[slot] = kernel_delta * cpu_factor
+        return {
+            'user_cpu_percent': user_cpu_percent,
+            'kernel_cpu_percent': kernel_cpu_percent,
+            'memory': memory.tolist(),
+            'memory_limit': memory_limit.tolist(),
+            'memory_percent': memory_percent,
+            'network_rx': network_rx,
+            'network_tx': network_tx,
+        }
+
+    def _new_column(self, capacity):
+        if self._numpy is not None:
+            return self._numpy.zeros(capacity)
+        return array('d', [0.0]) * capacity
+
+    def _grow(self, capacity):
+        """Extend all columns to the given number of slots"""
+        for name, column in self._columns.items():
+            extended = self._new_column(capacity)
+            extended[:len(column)] = column
+            self._columns[name] = extended
+        self._capacity = capacity
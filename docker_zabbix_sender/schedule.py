@@ -0,0 +1,107 @@
+# encoding: utf-8
+
+"""Scheduling of pushes to the endpoint"""
+
+__all__ = [
+    'AdaptiveInterval',
+]
+
+class AdaptiveInterval(object):
+    """Computes the delay before the next push according to the activity of containers.
+
+    - the interval falls back to the floor when a container starts or stops
+    - it is halved when a watched metric, summed over all containers, changed sharply since the previous push
+    - it grows when metrics are stable
+    - it grows as well when the previous push took a significant part of the interval,
+      or when the endpoint has batches waiting to be emitted, to let it catch up
+
+    The interval always stays between the floor and the ceiling.
+    """
+
+    # watched metric -> smallest total the change of the metric is relative to,
+    # so that the noise of idle containers is not considered as a sharp change
+    WATCHED_METRICS = {
+        'cpu.user_percent': 10.0,
+        'cpu.kernel_percent': 10.0,
+        'memory.used': 64.0 * 1024 * 1024,
+        'network_rx': 1024.0 * 1024,
+        'network_tx': 1024.0 * 1024,
+    }
+    WATCHED_METRIC_KEYS = tuple(sorted(WATCHED_METRICS))
+
+    def __init__(self, floor, ceiling, change_threshold=0.5, growth=1.5):
+        """
+        :param floor: minimum number of seconds between 2 pushes
+
+        :param ceiling: maximum number of seconds between 2 pushes
+
+        :param change_threshold: relative change of a watched metric above which
+        the interval is shortened
+
+        :param growth: factor applied to the interval when metrics are stable
+        """
+        if floor <= 0 or ceiling < floor:
+            raise ValueError("Invalid adaptive interval bounds: [{0}, {1}]".format(floor, ceiling))
+        self.floor = floor
+        self.ceiling = ceiling
+        self.change_threshold = change_threshold
+        self.growth = growth
+        self.interval = floor
+        self._previous = None
+
+    def churn(self):
+        """Containers started or stopped: fall back to the floor immediately
+
+        :return: the new interval, in seconds
+        """
+        self.interval = self.floor
+        return self.interval
+
+    def update(self, payload, churn, push_duration, pending=0):
+        """Compute the next interval.
+
+        :param payload: containers metrics about to be given to the endpoint
+
+        :param churn: True if containers started or stopped since the previous push
+
+        :param push_duration: number of seconds the endpoint took to handle the previous push
+
+        :param pending: number of batches the endpoint has not emitted yet
+
+        :return: the new interval, in seconds
+        """
+        change = self._max_relative_change(payload)
+        if churn:
+            interval = self.floor
+        elif change > self.change_threshold:
+            interval = self.interval / 2.0
+        else:
+            interval = self.interval * self.growth
+        if pending > 0 or push_duration * 2 > interval:
+            # the endpoint is backlogged
+            interval = max(interval, self.interval * self.growth, push_duration * 2)
+        self.interval = min(max(interval, self.floor), self.ceiling)
+        return self.interval
+
+    def _max_relative_change(self, payload):
+        """Compare the totals of watched metrics over all containers against
+        their values at the previous push.
+
+        :return: the highest relative change among watched metrics
+        """
+        totals = dict.fromkeys(AdaptiveInterval.WATCHED_METRIC_KEYS, 0.0)
+        for metrics in payload:
+            if metrics.get('id') is None:
+                continue
+            for key in AdaptiveInterval.WATCHED_METRIC_KEYS:
+                totals[key] += metrics.get(key, 0.0)
+        previous = self._previous
+        self._previous = totals
+        if previous is None:
+            return 0.0
+        change = 0.0
+        for key, minimum in AdaptiveInterval.WATCHED_METRICS.items():
+            delta = abs(totals[key] - previous[key]) / max(abs(previous[key]), minimum)
+            if delta > change:
+                change = delta
+        return change
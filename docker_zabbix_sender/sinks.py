@@ -0,0 +1,200 @@
+# encoding: utf-8
+
+"""Additional destinations of events, meant to be used with `FanOutEndPoint`.
+
+A sink is any object providing an `emit` member method taking a list of events
+in parameter, and optionally a `close` member method.
+"""
+
+import json
+import logging
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
+import re
+import socket
+import threading
+
+__all__ = [
+    'SinkWorker',
+    'NDJSONFileSink',
+    'StatsdSink',
+]
+
+class SinkWorker(threading.Thread):
+    """Feeds a sink from its own thread through a bounded queue of batches.
+
+    When the sink does not keep up, the oldest pending batch is dropped, so that
+    a slow sink never blocks the caller. Exceptions raised by the sink are logged
+    and do not stop the worker.
+    """
+
+    def __init__(self, sink, queue_size=4):
+        """
+        :param sink: object with an `emit` member method
+
+        :param queue_size: maximum number of pending batches
+        """
+        threading.Thread.__init__(self, name="sink-" + type(sink).__name__)
+        self.daemon = True
+        self.sink = sink
+        self.dropped = 0
+        self._stopping = False
+        self._queue = queue.Queue(queue_size)
+        self._logger = logging.getLogger("sink")
+
+    def submit(self, events):
+        """Queue a batch of events. Returns immediately.
+
+        :param events: list of dict with the following keys: hostname, timestamp, key, value
+        """
+        while True:
+            try:
+                self._queue.put_nowait(events)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                    self._logger.warning("%s is lagging behind, dropped a batch of events (%d so far)",
+                        self.name, self.dropped)
+                except queue.Empty:
+                    pass
+
+    def pending(self):
+        """Number of batches waiting to be emitted"""
+        return self._queue.qsize()
+
+    def run(self):
+        while True:
+            events = self._queue.get()
+            if events is None:
+                return
+            try:
+                self.sink.emit(events)
+            except Exception:
+                self._logger.exception("%s could not emit events", self.name)
+            if self._stopping and self._queue.empty():
+                return
+
+    def stop(self):
+        """Ask thread termination once pending batches are emitted. Method returns immediately.
+        You may call the `Thread.join` method, then the `close_sink` method afterward.
+        """
+        self._stopping = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            # the thread stops as soon as the queue is drained
+            pass
+
+    def close_sink(self):
+        """Close the sink, unless the thread is still running because the sink is stuck"""
+        if self.is_alive():
+            self._logger.error("%s is stuck, gave up with %d pending batches",
+                self.name, self.pending())
+            return
+        if hasattr(self.sink, 'close'):
+            try:
+                self.sink.close()
+            except Exception:
+                self._logger.exception("%s could not be closed", self.name)
+
+    def close(self, timeout=10.0):
+        """Flush pending batches, stop the thread and close the sink.
+
+        If the sink is stuck, the thread is abandoned after `timeout` seconds
+        and the sink is not closed.
+
+        :param timeout: maximum number of seconds to wait for pending batches
+        """
+        self.stop()
+        self.join(timeout)
+        self.close_sink()
+
+class NDJSONFileSink(object):
+    """Appends events to a file, one JSON document per line"""
+
+    def __init__(self, path):
+        """
+        :param path: path to the output file
+        """
+        self._ostr = open(path, 'a')
+
+    def emit(self, events):
+        self._ostr.write(''.join(json.dumps(event, default=str) + '\n' for event in events))
+        self._ostr.flush()
+
+    def close(self):
+        self._ostr.close()
+
+class StatsdSink(object):
+    """Sends numeric events as StatsD gauges over UDP:
+
+        {prefix}.{hostname}.{key}:{value}|g
+
+    A signed value updates a StatsD gauge instead of setting it,
+    so negative values are sent after a reset of the gauge to 0.
+
+    Dots in hostnames are replaced by underscores so that every host gets one
+    level in the metrics hierarchy, as Graphite expects. Characters of hostnames
+    and keys other than letters, digits, '_', '-' and '.', like the brackets of
+    Zabbix item keys parameters, are replaced by underscores as well.
+    """
+
+    MAX_DATAGRAM_SIZE = 1432
+    _INVALID_CHARS = re.compile(r'[^a-zA-Z0-9_\-.]')
+
+    def __init__(self, address, prefix='docker'):
+        """
+        :param address: tuple (host, port) of the StatsD server
+
+        :param prefix: prefix of every metric name
+        """
+        self._address = address
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._hostnames = {}
+        self._keys = {}
+
+    def emit(self, events):
+        datagram = bytearray()
+        for event in events:
+            value = event['value']
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = self._hostname(event['hostname']) + '.' + self._key(event['key'])
+            if value < 0:
+                line = '{0}:0|g\n{0}:{1}|g'.format(name, value).encode('utf-8')
+            else:
+                line = '{0}:{1}|g'.format(name, value).encode('utf-8')
+            if datagram and len(datagram) + len(line) + 1 > StatsdSink.MAX_DATAGRAM_SIZE:
+                self._socket.sendto(datagram, self._address)
+                datagram = bytearray()
+            if datagram:
+                datagram += b'\n'
+            datagram += line
+        if datagram:
+            self._socket.sendto(datagram, self._address)
+
+    def close(self):
+        self._socket.close()
+
+    def _key(self, key):
+        name = self._keys.get(key)
+        if name is None:
+            if len(self._keys) > 10000:
+                self._keys.clear()
+            name = self._keys[key] = StatsdSink._INVALID_CHARS.sub('_', key)
+        return name
+
+    def _hostname(self, hostname):
+        name = self._hostnames.get(hostname)
+        if name is None:
+            if len(self._hostnames) > 10000:
+                self._hostnames.clear()
+            name = StatsdSink._INVALID_CHARS.sub('_', hostname.replace('.', '_'))
+            name = self._hostnames[hostname] = self._prefix + '.' + name
+        return name
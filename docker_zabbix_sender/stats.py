@@ -2,8 +2,11 @@
 
 """Provides collection of events emitters"""
 
+import logging
+import os
+import threading
 import time
-from . import EndPoint
+from . import ContainerStats, EndPoint
 
 def container_count(host_fqdn, docker_client, statistics):
     """
@@ -51,6 +54,10 @@ def container_count(host_fqdn, docker_client, statistics):
         }
         for key, value in data.items()
     ]
+container_count.keys = [
+    EndPoint.EVENT_KEY_PREFIX + 'count.' + key
+    for key in ('all', 'running', 'crashed')
+]
 
 def container_ip(host_fqdn, docker_client, statistics):
     """Emit the ip addresses of containers.
@@ -64,6 +71,7 @@ def container_ip(host_fqdn, docker_client, statistics):
             'key': EndPoint.EVENT_KEY_PREFIX + 'ip',
             'value': details['NetworkSettings']['IPAddress']
         }
+container_ip.keys = [EndPoint.EVENT_KEY_PREFIX + 'ip']
 
 def cpu_count(host_fqdn, docker_client, statistics):
     """Emit the number of CPU available for each container.
@@ -73,5 +81,114 @@ def cpu_count(host_fqdn, docker_client, statistics):
             'hostname': EndPoint.container_hostname(host_fqdn, stat['name']),
             'timestamp': stat['timestamp'],
             'key': EndPoint.EVENT_KEY_PREFIX + 'cpu.count',
-            'value': len(stat['cpu_stats']['cpu_usage']['percpu_usage'])
+            'value': int(ContainerStats._online_cpus(stat['cpu_stats']))
         }
+cpu_count.keys = [EndPoint.EVENT_KEY_PREFIX + 'cpu.count']
+
+
+class DiskUsage(object):
+    """Emit `docker system df` information: size of layers, images, containers
+    writable layers, volumes and build cache, as well as dangling images and volumes.
+
+    Querying this information may take a long time on hosts with lots of images,
+    so it is refreshed by a single background thread every `interval` seconds:
+    queries never overlap.
+    The last known values are emitted at every push, and never wait for the Docker daemon.
+    """
+
+    def __init__(self, interval=600):
+        """
+        :param interval: number of seconds between 2 queries to the Docker daemon
+        """
+        self.interval = interval
+        self.keys = [
+            EndPoint.EVENT_KEY_PREFIX + 'df.' + key for key in (
+                'layers.size',
+                'images.count', 'images.size', 'images.dangling', 'images.dangling_size',
+                'containers.size_rw',
+                'volumes.count', 'volumes.size', 'volumes.dangling', 'volumes.dangling_size',
+                'build_cache.count', 'build_cache.size', 'build_cache.reclaimable',
+            )
+        ]
+        self._logger = logging.getLogger("disk-usage")
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._snapshot = None
+
+    def __call__(self, host_fqdn, docker_client, statistics):
+        if self._refresher is None:
+            with self._lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(
+                        target=self._refresh_forever,
+                        args=(docker_client,),
+                        name="disk-usage"
+                    )
+                    self._refresher.daemon = True
+                    self._refresher.start()
+        data = self._snapshot
+        if data is None:
+            return []
+        now = int(time.time())
+        return [
+            {
+                'hostname': '-',
+                'timestamp': now,
+                'key': EndPoint.EVENT_KEY_PREFIX + 'df.' + key,
+                'value': value
+            }
+            for key, value in data.items()
+        ]
+
+    def _refresh_forever(self, docker_client):
+        while True:
+            try:
+                self._snapshot = self.summarize(docker_client.df())
+            except Exception:
+                self._logger.exception("Could not get Docker disk usage")
+            time.sleep(self.interval)
+
+    @staticmethod
+    def summarize(df):
+        """Compute metrics from the result of Docker `df` API call
+
+        :return: dict of metric -> value
+        """
+        data = {'layers.size': df.get('LayersSize') or 0}
+
+        images = df.get('Images') or []
+        dangling_images = [
+            image for image in images
+            if not image.get('RepoTags') or image['RepoTags'] == ['<none>:<none>']
+        ]
+        data['images.count'] = len(images)
+        data['images.size'] = sum(image.get('Size', 0) for image in images)
+        data['images.dangling'] = len(dangling_images)
+        data['images.dangling_size'] = sum(image.get('Size', 0) for image in dangling_images)
+
+        containers = df.get('Containers') or []
+        data['containers.size_rw'] = sum(container.get('SizeRw') or 0 for container in containers)
+
+        volumes = df.get('Volumes') or []
+        data['volumes.count'] = len(volumes)
+        data['volumes.size'] = 0
+        data['volumes.dangling'] = 0
+        data['volumes.dangling_size'] = 0
+        for volume in volumes:
+            usage = volume.get('UsageData') or {}
+            # size is -1 when not available
+            size = max(usage.get('Size', 0), 0)
+            data['volumes.size'] += size
+            if usage.get('RefCount') == 0:
+                data['volumes.dangling'] += 1
+                data['volumes.dangling_size'] += size
+
+        build_cache = df.get('BuildCache') or []
+        data['build_cache.count'] = len(build_cache)
+        data['build_cache.size'] = sum(record.get('Size', 0) for record in build_cache)
+        data['build_cache.reclaimable'] = sum(
+            record.get('Size', 0) for record in build_cache if not record.get('InUse')
+        )
+        return data
+
+disk_usage = DiskUsage(int(os.environ.get('DOCKER_ZABBIX_SENDER_DF_INTERVAL', 600)))
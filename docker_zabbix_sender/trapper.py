@@ -0,0 +1,237 @@
+# encoding: utf-8
+
+"""EndPoint talking the Zabbix trapper protocol directly to several Zabbix servers or proxies"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import zlib
+
+from .endpoint import EndPoint
+from .protocol import FragmentCache, request, serialize_sender_data
+
+__all__ = [
+    'TrapperTarget',
+    'TrapperEndPoint',
+    'select_target',
+]
+
+class TrapperTarget(object):
+    """A Zabbix server or proxy receiving events.
+
+    A target is ejected after a failure, and given another chance after `retry_after` seconds.
+    """
+
+    def __init__(self, server, port=10051, max_connections=2):
+        """
+        :param server: hostname or IP address of the Zabbix server or proxy
+
+        :param port: port of the server trapper
+
+        :param max_connections: maximum number of concurrent requests to this target
+        """
+        self.server = server
+        self.port = int(port)
+        self.down_until = 0
+        self.max_connections = max_connections
+        self.connections = threading.BoundedSemaphore(max_connections)
+        # used for rendez-vous hashing of hostnames
+        self.name = '{0}:{1}'.format(server, port).encode('utf-8')
+
+    @classmethod
+    def parse(cls, address, default_port=10051, max_connections=2):
+        """Build a target from a 'server[:port]' string"""
+        server, _, port = address.strip().partition(':')
+        return cls(server, port or default_port, max_connections)
+
+    def healthy(self, now):
+        return self.down_until <= now
+
+    def __str__(self):
+        return '{0}:{1}'.format(self.server, self.port)
+
+class TrapperEndPoint(EndPoint):
+    """Pushes events to a set of Zabbix servers or proxies.
+
+    Every hostname is bound to one target by rendez-vous hashing so that all
+    events of a Zabbix host go through the same proxy, as long as it is healthy.
+    Events of a target are split in chunks that are sent in parallel.
+    When a target fails, it is ejected for a while and its chunks are
+    sent to the next target of the affected hostnames.
+    """
+
+    def __init__(self, host, targets, max_chunk_events=250, max_chunk_bytes=1 << 20,
+                 retry_after=60, timeout=5.0, active_checks=None):
+        """
+        :param host: FQDN of the host running the monitored containers.
+        Also used as Zabbix hostname of the daemon events.
+
+        :param targets: list of `TrapperTarget` instances
+
+        :param max_chunk_events: maximum number of events sent in a single request
+
+        :param max_chunk_bytes: maximum size of a single request
+
+        :param retry_after: number of seconds a failing target is ejected
+
+        :param timeout: socket timeout, in seconds
+
+        :param active_checks: optional `active.ActiveChecks` instance
+        """
+        EndPoint.__init__(self, host, active_checks=active_checks)
+        if not targets:
+            raise Exception("Invalid parameters: needs at least one Zabbix target")
+        self.targets = list(targets)
+        self._max_chunk_events = max_chunk_events
+        self._max_chunk_bytes = max_chunk_bytes
+        self._retry_after = retry_after
+        self._timeout = timeout
+        self._fragments = threading.local()
+        self._placements = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=sum(target.max_connections for target in self.targets)
+        )
+
+    def emit(self, events):
+        if not events:
+            return
+        now = time.time()
+        pending = []
+        for target, target_events in self._dispatch(events, now).items():
+            for chunk in self._chunks(target_events):
+                pending.append(self._executor.submit(
+                    self._send, target, chunk, set(), target.down_until
+                ))
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def state(self):
+        state = EndPoint.state(self)
+        now = time.time()
+        state['targets'] = [
+            {
+                'target': str(target),
+                'healthy': target.healthy(now),
+                'down_until': target.down_until,
+            }
+            for target in self.targets
+        ]
+        return state
+
+    def _dispatch(self, events, now, excluded=()):
+        """Group events per target
+
+        :return: dict target -> list of events
+        """
+        healthy = [
+            target for target in self.targets
+            if target not in excluded and target.healthy(now)
+        ]
+        if not healthy:
+            # everybody is down, give every target another chance
+            healthy = [target for target in self.targets if target not in excluded]
+        if not healthy:
+            return {}
+        placements = self._placements if not excluded else {}
+        if len(placements) > 10000:
+            placements.clear()
+        dispatched = {}
+        healthy_key = tuple(id(target) for target in healthy)
+        for event in events:
+            hostname = event['hostname']
+            if hostname == '-':
+                event = dict(event, hostname=self._host)
+                hostname = self._host
+            placement = placements.get(hostname)
+            if placement is None or placement[0] != healthy_key:
+                placement = placements[hostname] = (healthy_key, self._rendezvous(hostname, healthy))
+            target = placement[1]
+            target_events = dispatched.get(target)
+            if target_events is None:
+                target_events = dispatched[target] = []
+            target_events.append(event)
+        return dispatched
+
+    @staticmethod
+    def _rendezvous(hostname, targets):
+        """Select the target with the highest weight for a hostname"""
+        key = hostname.encode('utf-8')
+        return max(targets, key=lambda target: zlib.crc32(target.name + key))
+
+    def _chunks(self, events):
+        """Split events in chunks of at most `max_chunk_events` events"""
+        step = self._max_chunk_events
+        for start in range(0, len(events), step):
+            yield events[start:start + step]
+
+    def _serialize(self, events):
+        """Serialize a chunk, splitting it further if it is too large
+
+        :return: list of tuples (events, payload)
+        """
+        fragments = getattr(self._fragments, 'cache', None)
+        if fragments is None:
+            fragments = self._fragments.cache = FragmentCache()
+        payload = serialize_sender_data(events, fragments)
+        if len(payload) <= self._max_chunk_bytes or len(events) == 1:
+            return [(events, payload)]
+        middle = len(events) // 2
+        return self._serialize(events[:middle]) + self._serialize(events[middle:])
+
+    def _send(self, target, events, failed_targets, down_until):
+        """Send a chunk of events to a target, and fail over to other targets on error
+
+        :param down_until: `down_until` attribute of the target when the events
+        were dispatched. If the target was ejected since then, the events are
+        sent to other targets without trying this one again.
+        """
+        for chunk, payload in self._serialize(events):
+            try:
+                with target.connections:
+                    if target.down_until != down_until:
+                        response = None
+                    else:
+                        response = request(target.server, target.port, payload, self._timeout)
+            except Exception as e:
+                now = time.time()
+                if target.healthy(now):
+                    self._logger.warning("Zabbix target %s is ejected for %d seconds: %s",
+                        target, self._retry_after, e)
+                target.down_until = now + self._retry_after
+                failed_targets.add(target)
+                self._fail_over(chunk, failed_targets)
+                continue
+            if response is None:
+                # the target failed while this chunk was waiting
+                failed_targets.add(target)
+                self._fail_over(chunk, failed_targets)
+            elif response.get('response') != 'success':
+                self._logger.error("Zabbix target %s rejected %d events: %s",
+                    target, len(chunk), response.get('info'))
+            else:
+                self._logger.debug("Zabbix target %s: %s", target, response.get('info'))
+
+    def _fail_over(self, events, failed_targets):
+        """Send events to the next targets of their hostnames"""
+        dispatched = self._dispatch(events, time.time(), failed_targets)
+        if not dispatched:
+            self._logger.error("No Zabbix target available, %d events are lost", len(events))
+            return
+        for target, target_events in dispatched.items():
+            self._send(target, target_events, failed_targets, target.down_until)
+
+def select_target(hostname, targets, now):
+    """Select the target receiving the events of a hostname, as `TrapperEndPoint` does.
+
+    :param hostname: Zabbix hostname
+    :param targets: list of `TrapperTarget` instances
+    :param now: current UNIX time
+
+    :return: the healthy target with the highest weight for the hostname,
+    or the one among all targets if none is healthy
+    """
+    healthy = [target for target in targets if target.healthy(now)]
+    return TrapperEndPoint._rendezvous(hostname, healthy or targets)
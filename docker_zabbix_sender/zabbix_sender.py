@@ -7,12 +7,19 @@ import subprocess
 import signal
 import sys
 import tempfile
+import time
 
 from docker import DockerClient
 from docker.utils import kwargs_from_env
 
-from .endpoint import EndPoint
+from .endpoint import EndPoint, FanOutEndPoint
+from .sinks import NDJSONFileSink, StatsdSink
+from .trapper import TrapperEndPoint, TrapperTarget, select_target
 from .collector import ContainerStatsEmitter
+from .active import ActiveChecks
+from .debug import SamplingProfiler, dump_state
+from .schedule import AdaptiveInterval
+from .protocol import FragmentCache, serialize_lines
 
 LOGGER = logging.getLogger(__name__)
 
@@ -93,7 +100,9 @@ class ZabbixSenderEndPoint(EndPoint):
     def __init__(self, **kwargs):
         """
         :param kwargs: optional arguments given to the `zabbix_sender` function.
+        The 'active_checks' argument is given to the `EndPoint` instead.
         """
+        active_checks = kwargs.pop('active_checks', None)
         docker_daemon = kwargs.get('host')
         if docker_daemon is None:
             zabbix_agent_config = kwargs.get('config_file')
@@ -101,24 +110,20 @@ class ZabbixSenderEndPoint(EndPoint):
                 raise Exception("Invalid parameters: needs 'host' or 'config_file'")
             else:
                 docker_daemon = get_zabbix_hostname_from_config(zabbix_agent_config)
-        EndPoint.__init__(self, docker_daemon)
+        EndPoint.__init__(self, docker_daemon, active_checks=active_checks)
         self.zabbix_sender_p = ZabbixSenderProcess(
             input_file='-',
             with_timestamps=True,
             **kwargs
         )
+        self._fragments = FragmentCache()
 
     def emit(self, events):
-        if not any(events):
+        if not events:
             return
-        fmt = "{hostname} {key} {value}\n"
-        if events[0].has_key('timestamp'):
-            fmt = "{hostname} {key} {timestamp} {value}\n"
-        for event in events:
-            # Prevent empty string from crashing zabbix-sender
-            if event['value'] == "":
-                event['value'] = '""'
-            self.zabbix_sender_p.stdin.write(fmt.format(**event))
+        # the whole batch is serialized in one buffer, and written at once
+        self.zabbix_sender_p.stdin.write(serialize_lines(events, self._fragments))
+        self.zabbix_sender_p.stdin.flush()
 
     def close(self):
         self.zabbix_sender_p.communicate()
@@ -126,6 +131,9 @@ class ZabbixSenderEndPoint(EndPoint):
 def run(args=None):
     """Main entry point. Runs until SIGTERM or SIGINT is emitted.
 
+    SIGUSR1 starts a sampling profile of all threads, SIGUSR2 dumps
+    the daemon internal state. Both write a file in the temporary directory.
+
     :param args: Optional arguments, use `sys.argv[1:]` otherwise
     """
     if args is None:
@@ -157,7 +165,16 @@ def run(args=None):
     )
     parser.add_argument('-z', '--zabbix-server',
         metavar='<server>',
-        help='Hostname or IP address of Zabbix server'
+        help='Hostname or IP address of Zabbix server. '
+             'A comma-separated list of servers or proxies, optionally with ports (server:port), '
+             'can be given to spread events over them'
+    )
+    parser.add_argument('--max-connections',
+        metavar='<count>',
+        default=2,
+        type=int,
+        help='Maximum number of concurrent connections to each Zabbix server '
+             'when several are specified. Default is %(default)s'
     )
     parser.add_argument('-p', '--port',
         metavar='<server port>',
@@ -169,6 +186,18 @@ def run(args=None):
         type=int,
         help='Specify Zabbix update interval (in sec). Default is %(default)s'
     )
+    parser.add_argument('--min-interval',
+        metavar='<sec>',
+        type=float,
+        help='Enable adaptive update interval, between this value and --max-interval (in sec). '
+             'The interval shortens when containers metrics move sharply or containers start or stop, '
+             'and lengthens when they are stable.'
+    )
+    parser.add_argument('--max-interval',
+        metavar='<sec>',
+        type=float,
+        help='Maximum adaptive update interval (in sec). Default is --interval value'
+    )
     parser.add_argument('-r', '--real-time',
         action='store_true',
         help="zabbix_sender push metrics to Zabbix one by one as soon as they are sent."
@@ -177,6 +206,41 @@ def run(args=None):
         metavar='<hostname>',
         help='Specify host name. Host IP address and DNS name will not work'
     )
+    parser.add_argument('--cgroup-root',
+        metavar='<dir>',
+        default='/sys/fs/cgroup',
+        help='cgroup v2 mount point used to read containers pressure stall information. Default is %(default)s'
+    )
+    parser.add_argument('--active-checks',
+        action='store_true',
+        help="Only push items configured in Zabbix, at their update interval, as a Zabbix active agent would do."
+    )
+    parser.add_argument('--refresh-active-checks',
+        metavar='<sec>',
+        default=120,
+        type=int,
+        help='How often the list of active checks is refreshed (in sec). Default is %(default)s'
+    )
+    parser.add_argument('--rollup-label',
+        metavar='<label>',
+        action='append',
+        help='Also push metrics aggregated per value of this container label, '
+             'for instance com.docker.compose.project. Can be specified several times.'
+    )
+    parser.add_argument('--profile-duration',
+        metavar='<sec>',
+        default=30,
+        type=int,
+        help='Duration of the sampling profile started when SIGUSR1 is received. Default is %(default)s'
+    )
+    parser.add_argument('--ndjson',
+        metavar='<file>',
+        help='Also append events to this file, one JSON document per line'
+    )
+    parser.add_argument('--statsd',
+        metavar='<host:port>',
+        help='Also send numeric events as gauges to this StatsD server'
+    )
     args = parser.parse_args(args)
     kwargs  = kwargs_from_env()
     if not args.tlsverify.lower() in ("yes", "true", "t", "1"):
@@ -189,25 +253,91 @@ def run(args=None):
     if args.host is None:
         args.host = os.environ['ZABBIX_HOST']
 
-    emitter = ContainerStatsEmitter(
-        docker_client,
-        ZabbixSenderEndPoint(
+    active_checks = None
+    zabbix_servers = [
+        TrapperTarget.parse(server, args.port or 10051, args.max_connections)
+        for server in args.zabbix_server.split(',')
+    ]
+    if args.active_checks:
+        locate = None
+        if len(zabbix_servers) > 1:
+            # ask the items of a host to the server its events are sent to
+            def locate(hostname):
+                target = select_target(hostname, zabbix_servers, time.time())
+                return target.server, target.port
+        active_checks = ActiveChecks(
+            zabbix_servers[0].server,
+            zabbix_servers[0].port,
+            refresh=args.refresh_active_checks,
+            locate=locate
+        )
+        active_checks.start()
+
+    endpoint_active_checks = None if args.ndjson or args.statsd else active_checks
+    if len(zabbix_servers) > 1:
+        endpoint = TrapperEndPoint(
+            args.host,
+            zabbix_servers,
+            active_checks=endpoint_active_checks
+        )
+    else:
+        endpoint = ZabbixSenderEndPoint(
             config_file=args.config,
             zabbix_server=args.zabbix_server,
             host=args.host,
             port=args.port,
             real_time=args.real_time,
+            active_checks=endpoint_active_checks,
             verbose=args.verbose if args.verbose is not None else 0
-        ),
-        args.interval)
+        )
+    if args.ndjson or args.statsd:
+        sinks = [endpoint]
+        if args.ndjson:
+            sinks.append(NDJSONFileSink(args.ndjson))
+        if args.statsd:
+            statsd_host, statsd_port = args.statsd.rsplit(':', 1)
+            sinks.append(StatsdSink((statsd_host, int(statsd_port))))
+        endpoint = FanOutEndPoint(endpoint.host, sinks, active_checks=active_checks)
+
+    scheduler = None
+    if args.min_interval is not None:
+        scheduler = AdaptiveInterval(
+            args.min_interval,
+            args.max_interval if args.max_interval is not None else args.interval
+        )
+
+    emitter = ContainerStatsEmitter(
+        docker_client,
+        endpoint,
+        args.interval,
+        cgroup_root=args.cgroup_root,
+        rollup_labels=args.rollup_label,
+        scheduler=scheduler,
+        active_checks=active_checks)
     def _stop_emitter(signum, frame):
         """Handle for signal catching used to stop the `ContainerStatsEmitter` thread
         """
         emitter.shutdown()
+    profiler = SamplingProfiler(duration=args.profile_duration)
+    def _start_profile(signum, frame):
+        """Handle for signal catching used to profile the daemon threads
+        """
+        profiler.start()
+    def _dump_state(signum, frame):
+        """Handle for signal catching used to dump the daemon internal state
+        """
+        try:
+            dump_state(emitter)
+        except Exception:
+            LOGGER.exception("Could not dump daemon state")
     signal.signal(signal.SIGTERM, _stop_emitter)
     signal.signal(signal.SIGINT, _stop_emitter)
+    signal.signal(signal.SIGUSR1, _start_profile)
+    signal.signal(signal.SIGUSR2, _dump_state)
     emitter.start()
-    signal.pause()
+    # signal handlers are run by the main thread, keep it alive
+    while emitter.is_alive():
+        emitter.join(1)
 
 if __name__ == '__main__':
     run()
@@ -52,7 +52,13 @@ setup(
     packages=['docker_zabbix_sender'],
     install_requires=[
         'docker >= 4.0.0',
+        # concurrent.futures backport
+        'futures; python_version < "3"',
     ],
+    extras_require={
+        # vectorized computation of containers metrics
+        'numpy': ['numpy'],
+    },
     zip_safe=False,
     license="Apache license version 2.0",
     classifiers=[
@@ -76,5 +82,6 @@ setup(
         container-count = docker_zabbix_sender.stats:container_count
         cpu-count = docker_zabbix_sender.stats:cpu_count
         container-ip = docker_zabbix_sender.stats:container_ip
+        disk-usage = docker_zabbix_sender.stats:disk_usage
     """
 )
@@ -0,0 +1,151 @@
+# encoding: utf-8
+
+"""Tests of `SampleStore`"""
+
+import os
+import random
+import sys
+import types
+import unittest
+
+try:
+    from docker_zabbix_sender import samples
+except ImportError:
+    # the package requires the docker client, the tested modules do not:
+    # load them without running the package __init__
+    package = types.ModuleType('docker_zabbix_sender')
+    package.__path__ = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docker_zabbix_sender')]
+    sys.modules['docker_zabbix_sender'] = package
+    from docker_zabbix_sender import samples
+
+def record(store, container, user_cpu=0.0, kernel_cpu=0.0, system_cpu=0.0, online_cpus=4.0,
+           memory=0.0, memory_limit=0.0, network_rx=0.0, network_tx=0.0):
+    store.record(container, user_cpu, kernel_cpu, system_cpu, online_cpus,
+                 memory, memory_limit, network_rx, network_tx)
+
+def metrics(batch, container):
+    index = batch.index(container)
+    if index is None:
+        return None
+    return dict((name, getattr(batch, name)[index]) for name in samples.SampleBatch.COLUMNS)
+
+class SampleStoreTest(unittest.TestCase):
+
+    def make_store(self, capacity=64):
+        return samples.SampleStore(capacity, use_numpy=False)
+
+    def test_derived_metrics(self):
+        store = self.make_store()
+        store.allocate('a')
+        record(store, 'a', user_cpu=1e9, kernel_cpu=1e8, system_cpu=1e12,
+               memory=256.0, memory_limit=1024.0, network_rx=1000.0, network_tx=500.0)
+        # CPU and network need 2 samples
+        self.assertEqual({
+            'user_cpu_percent': 0.0,
+            'kernel_cpu_percent': 0.0,
+            'memory': 256.0,
+            'memory_limit': 1024.0,
+            'memory_percent': 25.0,
+            'network_rx': 0.0,
+            'network_tx': 0.0,
+        }, metrics(store.compute(), 'a'))
+        record(store, 'a', user_cpu=1e9 + 2e8, kernel_cpu=1e8 + 1e8, system_cpu=1e12 + 4e9,
+               memory=512.0, memory_limit=1024.0, network_rx=3000.0, network_tx=600.0)
+        self.assertEqual({
+            'user_cpu_percent': 20.0,
+            'kernel_cpu_percent': 10.0,
+            'memory': 512.0,
+            'memory_limit': 1024.0,
+            'memory_percent': 50.0,
+            'network_rx': 2000.0,
+            'network_tx': 100.0,
+        }, metrics(store.compute(), 'a'))
+        self.assertEqual(metrics(store.compute(), 'a'), store.sample('a'))
+
+    def test_no_sample(self):
+        store = self.make_store()
+        store.allocate('a')
+        self.assertIsNone(store.compute().index('a'))
+        self.assertIsNone(store.sample('a'))
+        self.assertIsNone(store.sample('unknown'))
+        # samples of unknown containers are ignored
+        record(store, 'unknown', memory=1.0)
+        self.assertIsNone(store.sample('unknown'))
+
+    def test_no_memory_limit(self):
+        store = self.make_store()
+        store.allocate('a')
+        record(store, 'a', memory=256.0)
+        self.assertEqual(0.0, store.sample('a')['memory_percent'])
+
+    def test_release_and_reuse(self):
+        store = self.make_store(capacity=2)
+        store.allocate('a')
+        store.allocate('b')
+        record(store, 'a', memory=1.0)
+        record(store, 'b', memory=2.0)
+        slot = store.compute().index('a')
+        store.release('a')
+        record(store, 'a', memory=3.0)
+        self.assertIsNone(store.compute().index('a'))
+        # the slot of 'a' is given to 'c', without the samples of 'a'
+        store.allocate('c')
+        batch = store.compute()
+        self.assertEqual(slot, store._slots['c'])
+        self.assertIsNone(batch.index('c'))
+        record(store, 'c', memory=4.0)
+        self.assertEqual(4.0, store.sample('c')['memory'])
+        self.assertEqual(0.0, store.sample('c')['network_rx'])
+        self.assertEqual(2.0, store.sample('b')['memory'])
+
+    def test_allocate_twice(self):
+        store = self.make_store()
+        store.allocate('a')
+        record(store, 'a', memory=1.0)
+        store.allocate('a')
+        self.assertEqual(1.0, store.sample('a')['memory'])
+
+    def test_growth(self):
+        store = self.make_store(capacity=1)
+        for i in range(100):
+            store.allocate(i)
+            record(store, i, memory=float(i), memory_limit=100.0, network_rx=float(i))
+            record(store, i, memory=float(i), memory_limit=100.0, network_rx=float(3 * i))
+        batch = store.compute()
+        for i in range(100):
+            self.assertEqual(float(i), metrics(batch, i)['memory'])
+            self.assertEqual(float(i), metrics(batch, i)['memory_percent'])
+            self.assertEqual(float(2 * i), metrics(batch, i)['network_rx'])
+
+    @unittest.skipIf(samples.numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        stores = [samples.SampleStore(4, use_numpy=False), samples.SampleStore(4, use_numpy=True)]
+        rng = random.Random(42)
+        containers = list(range(20))
+        for container in containers:
+            for store in stores:
+                store.allocate(container)
+        for _ in range(3):
+            for container in containers:
+                values = [rng.uniform(0.0, 1e9) for _ in range(8)]
+                # some containers have no memory limit, or no CPU activity
+                if container % 3 == 0:
+                    values[5] = 0.0
+                if container % 4 == 0:
+                    values[2] = 0.0
+                for store in stores:
+                    record(store, container, *values)
+            for store in stores:
+                store.release(7)
+        python_batch, numpy_batch = [store.compute() for store in stores]
+        for container in containers:
+            python_metrics = metrics(python_batch, container)
+            numpy_metrics = metrics(numpy_batch, container)
+            if python_metrics is None:
+                self.assertIsNone(numpy_metrics)
+                continue
+            for name, value in python_metrics.items():
+                self.assertAlmostEqual(value, numpy_metrics[name], places=6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# encoding: utf-8
+
+"""Tests of `AdaptiveInterval`"""
+
+import os
+import random
+import sys
+import types
+import unittest
+
+try:
+    from docker_zabbix_sender import schedule
+except ImportError:
+    # the package requires the docker client, the tested modules do not:
+    # load them without running the package __init__
+    package = types.ModuleType('docker_zabbix_sender')
+    package.__path__ = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docker_zabbix_sender')]
+    sys.modules['docker_zabbix_sender'] = package
+    from docker_zabbix_sender import schedule
+
+def steady_payload(rng, containers=50, busy=None):
+    """Metrics of mostly idle containers, with some noise"""
+    payload = []
+    for i in range(containers):
+        payload.append({
+            'id': 'container-{0}'.format(i),
+            'cpu.user_percent': rng.uniform(0.0, 0.5) if i != busy else 80.0,
+            'cpu.kernel_percent': rng.uniform(0.0, 0.2),
+            'memory.used': 100.0 * 1024 * 1024 + rng.uniform(0.0, 1024.0 * 1024),
+            'network_rx': rng.choice([0.0, 0.0, 120.0, 1500.0]),
+            'network_tx': rng.choice([0.0, 60.0]),
+        })
+    # entries of groups and of the daemon are ignored
+    payload.append({'name': 'web', 'label': 'app', 'count': containers})
+    payload.append({'hostname': '-', 'sender.interval': 5})
+    return payload
+
+class AdaptiveIntervalTest(unittest.TestCase):
+
+    def test_invalid_bounds(self):
+        self.assertRaises(ValueError, schedule.AdaptiveInterval, 0, 10)
+        self.assertRaises(ValueError, schedule.AdaptiveInterval, 10, 5)
+
+    def test_steady_host(self):
+        rng = random.Random(42)
+        scheduler = schedule.AdaptiveInterval(5, 120)
+        intervals = [scheduler.update(steady_payload(rng), False, 0.1) for _ in range(30)]
+        # noise of idle containers does not shorten the interval
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertEqual(120, intervals[-1])
+
+    def test_sharp_change(self):
+        rng = random.Random(42)
+        scheduler = schedule.AdaptiveInterval(5, 120)
+        for _ in range(30):
+            scheduler.update(steady_payload(rng), False, 0.1)
+        self.assertEqual(60, scheduler.update(steady_payload(rng, busy=3), False, 0.1))
+        self.assertEqual(90, scheduler.update(steady_payload(rng, busy=3), False, 0.1))
+
+    def test_churn(self):
+        rng = random.Random(42)
+        scheduler = schedule.AdaptiveInterval(5, 120)
+        for _ in range(10):
+            scheduler.update(steady_payload(rng), False, 0.1)
+        self.assertEqual(5, scheduler.churn())
+        self.assertEqual(5, scheduler.update(steady_payload(rng, containers=51), True, 0.1))
+
+    def test_backlog(self):
+        rng = random.Random(42)
+        scheduler = schedule.AdaptiveInterval(5, 120)
+        scheduler.update(steady_payload(rng), False, 0.1)
+        # a sharp change does not shorten the interval when the endpoint lags behind
+        self.assertEqual(11.25, scheduler.update(steady_payload(rng, busy=3), False, 0.1, pending=2))
+        self.assertEqual(30, scheduler.update(steady_payload(rng), False, 15.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# encoding: utf-8
+
+"""Tests of the additional outputs: sinks, their workers and `FanOutEndPoint`"""
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+try:
+    from docker_zabbix_sender import endpoint, sinks
+except ImportError:
+    # the package requires the docker client, the tested modules do not:
+    # load them without running the package __init__
+    package = types.ModuleType('docker_zabbix_sender')
+    package.__path__ = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docker_zabbix_sender')]
+    sys.modules['docker_zabbix_sender'] = package
+    from docker_zabbix_sender import endpoint, sinks
+
+def make_event(key, value, hostname='web.docker.acme.com'):
+    return {'hostname': hostname, 'timestamp': 1424363786, 'key': key, 'value': value}
+
+class RecordingSink(object):
+    """Records batches of events. Emitting blocks as long as `blocked` is set."""
+
+    def __init__(self, blocked=False):
+        self.batches = []
+        self.closed = False
+        self.unblocked = threading.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    def emit(self, events):
+        self.unblocked.wait()
+        self.batches.append(events)
+
+    def close(self):
+        self.closed = True
+
+class StatsdSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.settimeout(1.0)
+        self.addCleanup(self.listener.close)
+        self.sink = sinks.StatsdSink(self.listener.getsockname())
+        self.addCleanup(self.sink.close)
+
+    def receive(self):
+        """:return: list of datagrams sent to the listener"""
+        datagrams = []
+        try:
+            while True:
+                datagrams.append(self.listener.recv(65536).decode('utf-8'))
+                self.listener.settimeout(0.2)
+        except socket.timeout:
+            return datagrams
+
+    def test_gauges(self):
+        self.sink.emit([
+            make_event('docker.container.memory.used', 1024),
+            make_event('docker.container.cpu.user_percent', 12.5),
+            make_event('docker.container.ip', '172.17.0.2'),
+            make_event('docker.container.running', True),
+        ])
+        self.assertEqual([
+            'docker.web_docker_acme_com.docker.container.memory.used:1024|g\n'
+            'docker.web_docker_acme_com.docker.container.cpu.user_percent:12.5|g'
+        ], self.receive())
+
+    def test_negative_gauges(self):
+        self.sink.emit([make_event('docker.container.delta', -5)])
+        # a signed value would update the gauge instead of setting it
+        self.assertEqual([
+            'docker.web_docker_acme_com.docker.container.delta:0|g\n'
+            'docker.web_docker_acme_com.docker.container.delta:-5|g'
+        ], self.receive())
+
+    def test_invalid_characters(self):
+        self.sink.emit([make_event('vfs.fs.size[/var/lib,used]', 1, hostname='web:1|x')])
+        self.assertEqual(['docker.web_1_x.vfs.fs.size__var_lib_used_:1|g'], self.receive())
+
+    def test_datagrams_split(self):
+        events = [make_event('docker.container.metric_{0}'.format(i), i) for i in range(200)]
+        self.sink.emit(events)
+        datagrams = self.receive()
+        self.assertTrue(len(datagrams) > 1)
+        for datagram in datagrams:
+            self.assertTrue(len(datagram.encode('utf-8')) <= sinks.StatsdSink.MAX_DATAGRAM_SIZE)
+        lines = [line for datagram in datagrams for line in datagram.split('\n')]
+        self.assertEqual(
+            ['docker.web_docker_acme_com.docker.container.metric_{0}:{0}|g'.format(i) for i in range(200)],
+            lines
+        )
+
+class NDJSONFileSinkTest(unittest.TestCase):
+
+    def test_emit(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'events.ndjson')
+        sink = sinks.NDJSONFileSink(path)
+        events = [make_event('docker.container.memory.used', 1024), make_event('docker.container.ip', '')]
+        sink.emit(events)
+        sink.emit(events[:1])
+        sink.close()
+        with open(path) as istr:
+            self.assertEqual(events + events[:1], [json.loads(line) for line in istr])
+
+class SinkWorkerTest(unittest.TestCase):
+
+    def test_flush_on_close(self):
+        sink = RecordingSink()
+        worker = sinks.SinkWorker(sink, queue_size=4)
+        worker.start()
+        for i in range(3):
+            worker.submit([make_event('k', i)])
+        worker.close(timeout=1.0)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(3, len(sink.batches))
+        self.assertTrue(sink.closed)
+
+    def test_drop_on_lag(self):
+        sink = RecordingSink(blocked=True)
+        worker = sinks.SinkWorker(sink, queue_size=2)
+        worker.start()
+        worker.submit([make_event('k', 0)])
+        # wait for the worker to be stuck on the first batch
+        deadline = time.time() + 1.0
+        while worker.pending() and time.time() < deadline:
+            time.sleep(0.01)
+        start = time.time()
+        for i in range(1, 6):
+            worker.submit([make_event('k', i)])
+        # submitting never waits for the sink
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(3, worker.dropped)
+        self.assertEqual(2, worker.pending())
+        sink.unblocked.set()
+        worker.close(timeout=1.0)
+        # the oldest batches were dropped
+        self.assertEqual([0, 4, 5], [batch[0]['value'] for batch in sink.batches])
+
+    def test_stuck_sink(self):
+        sink = RecordingSink(blocked=True)
+        worker = sinks.SinkWorker(sink)
+        worker.start()
+        worker.submit([make_event('k', 0)])
+        start = time.time()
+        worker.close(timeout=0.2)
+        self.assertLess(time.time() - start, 1.0)
+        self.assertTrue(worker.is_alive())
+        self.assertFalse(sink.closed)
+        sink.unblocked.set()
+
+class FanOutEndPointTest(unittest.TestCase):
+
+    def test_emit(self):
+        fast, slow = RecordingSink(), RecordingSink(blocked=True)
+        fan_out = endpoint.FanOutEndPoint('docker.acme.com', [slow, fast], queue_size=2, close_timeout=0.5)
+        self.addCleanup(slow.unblocked.set)
+        for i in range(6):
+            fan_out.emit([make_event('k', i)])
+            time.sleep(0.05)
+        fan_out.close()
+        # the slow sink did not delay the fast one
+        self.assertEqual(6, len(fast.batches))
+        self.assertTrue(fan_out._workers[0].dropped > 0)
+
+    def test_close_isolation(self):
+        stuck, healthy = RecordingSink(blocked=True), RecordingSink()
+        fan_out = endpoint.FanOutEndPoint('docker.acme.com', [stuck, healthy], close_timeout=1.0)
+        self.addCleanup(stuck.unblocked.set)
+        fan_out.emit([make_event('k', 0)])
+        start = time.time()
+        fan_out.close()
+        self.assertLess(time.time() - start, 2.0)
+        # the stuck sink does not prevent the next one to be flushed and closed
+        self.assertEqual(1, len(healthy.batches))
+        self.assertTrue(healthy.closed)
+        self.assertFalse(stuck.closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+# encoding: utf-8
+
+"""Tests of `TrapperEndPoint` against local stand-in Zabbix trappers"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import types
+import unittest
+
+try:
+    from docker_zabbix_sender import active, trapper
+except ImportError:
+    # the package requires the docker client, the tested modules do not:
+    # load them without running the package __init__
+    package = types.ModuleType('docker_zabbix_sender')
+    package.__path__ = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docker_zabbix_sender')]
+    sys.modules['docker_zabbix_sender'] = package
+    from docker_zabbix_sender import active, trapper
+
+def _recv_exactly(sock, length):
+    buf = bytearray()
+    while len(buf) < length:
+        chunk = sock.recv(length - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+class StandInTrapper(threading.Thread):
+    """Listens on a local port and behaves like a Zabbix trapper.
+
+    - 'good' records received events and acknowledges them. Active checks
+      requests are answered with a single item selecting 'stand-in[<port>]'
+    - 'failing' closes connections without answering
+    - 'hung' accepts connections and never answers
+    """
+
+    def __init__(self, mode='good'):
+        threading.Thread.__init__(self, name="stand-in-" + mode)
+        self.daemon = True
+        self.mode = mode
+        self.events = []
+        self.requests = []
+        self.accepted = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._connections = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(64)
+        self._socket.settimeout(0.1)
+        self.port = self._socket.getsockname()[1]
+
+    def target(self, max_connections=2):
+        return trapper.TrapperTarget('127.0.0.1', self.port, max_connections)
+
+    def hostnames(self):
+        with self._lock:
+            return set(event['host'] for event in self.events)
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            connection.settimeout(None)
+            with self._lock:
+                self.accepted += 1
+                self._connections.append(connection)
+            handler = threading.Thread(target=self._handle, args=(connection,))
+            handler.daemon = True
+            handler.start()
+        self._socket.close()
+
+    def _handle(self, connection):
+        if self.mode == 'hung':
+            self._stopping.wait()
+            return
+        if self.mode == 'failing':
+            connection.close()
+            return
+        header = _recv_exactly(connection, 13)
+        if header is None:
+            return
+        length = struct.unpack('<Q', header[5:13])[0]
+        request = json.loads(_recv_exactly(connection, length).decode('utf-8'))
+        with self._lock:
+            self.requests.append(request)
+            if request['request'] == 'sender data':
+                self.events.extend(request['data'])
+        if request['request'] == 'active checks':
+            response = {
+                'response': 'success',
+                'data': [{'key': 'docker.sender.push[stand-in[{0}]]'.format(self.port), 'delay': 30}],
+            }
+        else:
+            response = {
+                'response': 'success',
+                'info': 'processed: {0}; failed: 0'.format(len(request['data'])),
+            }
+        response = json.dumps(response).encode('utf-8')
+        connection.sendall(b'ZBXD\x01' + struct.pack('<Q', len(response)) + response)
+        connection.close()
+
+    def stop(self):
+        self._stopping.set()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+        self.join()
+
+def make_events(hosts=50, keys=20):
+    return [
+        {
+            'hostname': 'container-{0}.docker.acme.com'.format(host),
+            'key': 'docker.container.metric_{0}'.format(key),
+            'timestamp': 1424363786,
+            'value': float(host * keys + key),
+        }
+        for host in range(hosts)
+        for key in range(keys)
+    ]
+
+class TrapperEndPointTest(unittest.TestCase):
+
+    def start_trappers(self, *modes):
+        trappers = [StandInTrapper(mode) for mode in modes]
+        for stand_in in trappers:
+            stand_in.start()
+            self.addCleanup(stand_in.stop)
+        return trappers
+
+    def make_endpoint(self, trappers, **kwargs):
+        kwargs.setdefault('max_chunk_events', 10)
+        kwargs.setdefault('timeout', 0.5)
+        endpoint = trapper.TrapperEndPoint(
+            'docker.acme.com',
+            [stand_in.target() for stand_in in trappers],
+            **kwargs
+        )
+        self.addCleanup(endpoint.close)
+        return endpoint
+
+    def assertDelivered(self, events, trappers):
+        received = sorted(
+            (event['host'], event['key'])
+            for stand_in in trappers
+            for event in stand_in.events
+        )
+        expected = sorted((event['hostname'], event['key']) for event in events)
+        self.assertEqual(expected, received)
+
+    def assertSticky(self, trappers):
+        """Every hostname went through a single target"""
+        seen = set()
+        for stand_in in trappers:
+            hostnames = stand_in.hostnames()
+            self.assertFalse(seen & hostnames)
+            seen |= hostnames
+
+    def test_delivery(self):
+        trappers = self.start_trappers('good', 'good', 'good')
+        endpoint = self.make_endpoint(trappers)
+        events = make_events()
+        endpoint.emit(events)
+        self.assertDelivered(events, trappers)
+        self.assertSticky(trappers)
+        # events are spread over all targets, in chunks of at most 10 events
+        for stand_in in trappers:
+            self.assertTrue(stand_in.events)
+            self.assertTrue(all(len(request['data']) <= 10 for request in stand_in.requests))
+
+    def test_stickiness(self):
+        trappers = self.start_trappers('good', 'good', 'good')
+        endpoint = self.make_endpoint(trappers)
+        endpoint.emit(make_events())
+        placements = [stand_in.hostnames() for stand_in in trappers]
+        for stand_in in trappers:
+            del stand_in.events[:]
+        endpoint.emit(make_events())
+        self.assertEqual(placements, [stand_in.hostnames() for stand_in in trappers])
+
+    def test_daemon_events(self):
+        trappers = self.start_trappers('good')
+        endpoint = self.make_endpoint(trappers)
+        endpoint.emit([{'hostname': '-', 'key': 'docker.count.all', 'timestamp': 1424363786, 'value': 3}])
+        self.assertEqual(set(['docker.acme.com']), trappers[0].hostnames())
+
+    def test_failing_target(self):
+        trappers = self.start_trappers('good', 'good', 'failing')
+        healthy = trappers[:2]
+        endpoint = self.make_endpoint(trappers)
+        events = make_events()
+        endpoint.emit(events)
+        self.assertDelivered(events, healthy)
+        self.assertSticky(healthy)
+        self.assertFalse(endpoint.targets[2].healthy(time.time()))
+        self.assertTrue(all(target.healthy(time.time()) for target in endpoint.targets[:2]))
+        # hostnames of the healthy targets did not move, and those of
+        # the failing target stick to their new target
+        for event in events:
+            placement = endpoint._rendezvous(event['hostname'], endpoint.targets)
+            if placement is not endpoint.targets[2]:
+                self.assertIn(event['hostname'], trappers[endpoint.targets.index(placement)].hostnames())
+        placements = [stand_in.hostnames() for stand_in in healthy]
+        for stand_in in healthy:
+            del stand_in.events[:]
+        endpoint.emit(events)
+        self.assertEqual(placements, [stand_in.hostnames() for stand_in in healthy])
+
+    def test_hung_target(self):
+        trappers = self.start_trappers('good', 'good', 'hung')
+        endpoint = self.make_endpoint(trappers, max_chunk_events=5, timeout=0.5)
+        events = make_events(hosts=60)
+        start = time.time()
+        endpoint.emit(events)
+        duration = time.time() - start
+        self.assertDelivered(events, trappers[:2])
+        # chunks waiting for the hung target fail over as soon as it is ejected,
+        # instead of timing out one after the other
+        self.assertLess(duration, 4 * 0.5)
+        self.assertFalse(endpoint.targets[2].healthy(time.time()))
+        # the hung target is not tried anymore
+        start = time.time()
+        endpoint.emit(events)
+        self.assertLess(time.time() - start, 0.5)
+
+class ActiveChecksTest(unittest.TestCase):
+
+    def test_items_asked_to_host_target(self):
+        trappers = [StandInTrapper('good') for _ in range(3)]
+        for stand_in in trappers:
+            stand_in.start()
+            self.addCleanup(stand_in.stop)
+        targets = [stand_in.target() for stand_in in trappers]
+        def locate(hostname):
+            target = trapper.select_target(hostname, targets, time.time())
+            return target.server, target.port
+        active_checks = active.ActiveChecks('127.0.0.1', 1, timeout=0.5, locate=locate)
+        endpoint = trapper.TrapperEndPoint('docker.acme.com', targets, timeout=0.5)
+        self.addCleanup(endpoint.close)
+        hostnames = ['container-{0}.docker.acme.com'.format(host) for host in range(20)]
+        for eject in (False, True):
+            if eject:
+                targets[0].down_until = time.time() + 60
+            for hostname in hostnames:
+                for stand_in in trappers:
+                    del stand_in.events[:]
+                endpoint.emit([{'hostname': hostname, 'key': 'k', 'timestamp': 1424363786, 'value': 1}])
+                sender = [stand_in for stand_in in trappers if stand_in.events][0]
+                self.assertEqual(
+                    {'stand-in[{0}]'.format(sender.port): 30},
+                    active_checks.fetch(hostname)
+                )
+
+    def test_selected_keys(self):
+        active_checks = active.ActiveChecks('127.0.0.1', 1)
+        self.assertIsNone(active_checks.selected_keys())
+        active_checks.track(set(['a', 'b']))
+        active_checks._items['a'] = {'docker.container.memory.used': 30}
+        # items of 'b' are unknown
+        self.assertIsNone(active_checks.selected_keys())
+        active_checks._items['b'] = {'docker.container.pressure.cpu.some_avg10': 60}
+        self.assertEqual(
+            set(['docker.container.memory.used', 'docker.container.pressure.cpu.some_avg10']),
+            active_checks.selected_keys()
+        )
+
+    def test_unreachable_server(self):
+        failing, good = StandInTrapper('failing'), StandInTrapper('good')
+        for stand_in in (failing, good):
+            stand_in.start()
+            self.addCleanup(stand_in.stop)
+        hostnames = set('container-{0}.docker.acme.com'.format(host) for host in range(20))
+        def locate(hostname):
+            stand_in = failing if int(hostname.split('.')[0].split('-')[1]) % 2 else good
+            return '127.0.0.1', stand_in.port
+        active_checks = active.ActiveChecks('127.0.0.1', 1, timeout=0.5, locate=locate)
+        active_checks.track(hostnames)
+        active_checks.start()
+        self.addCleanup(active_checks.shutdown)
+        deadline = time.time() + 5
+        while active_checks.state()['fetched_hosts'] < 10 and time.time() < deadline:
+            time.sleep(0.05)
+        # hosts of the reachable server are fetched, the failing server is asked only once per round
+        self.assertEqual(10, active_checks.state()['fetched_hosts'])
+        self.assertEqual(1, failing.accepted)
+
+if __name__ == '__main__':
+    unittest.main()